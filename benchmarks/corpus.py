@@ -0,0 +1,113 @@
+"""Generate markup files that use all of the default syntax."""
+
+import os
+import random
+
+_WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+          'eiusmod tempor incididunt ut labore et dolore magna aliqua').split()
+
+_CODE = '''\
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n-1) + fib(n-2)
+
+print('page %d', [fib(i) for i in range(%d)])
+'''
+
+_IMAGE = ('<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10">'
+          '<rect width="10" height="10" /></svg>\n')
+
+
+def _sentence(rnd, pagecount):
+    words = rnd.choices(_WORDS, k=rnd.randint(6, 16))
+    markup = [
+        lambda word: '**%s**' % word,
+        lambda word: '*%s*' % word,
+        lambda word: '_%s_' % word,
+        lambda word: '``%s``' % word,
+        lambda word: '[%s](page%d.html)' % (word, rnd.randrange(pagecount)),
+        lambda word: '[%s](#section-%d)' % (word, rnd.randrange(3)),
+        lambda word: word + ' --',
+    ]
+    for index in rnd.sample(range(len(words)), 3):
+        words[index] = rnd.choice(markup)(words[index])
+    return ' '.join(words).capitalize() + '.'
+
+
+def _paragraph(rnd, pagecount):
+    return '\n'.join(_sentence(rnd, pagecount)
+                     for _ in range(rnd.randint(2, 6)))
+
+
+def long_paragraph(rnd, pagecount, sentences=5000):
+    """Return one paragraph with lots of inline markup.
+
+    Converting this takes a long time if something is quadratic in the
+    number of ``**bold**`` and other inline things in a paragraph.
+    """
+    return '\n'.join(_sentence(rnd, pagecount) for _ in range(sentences))
+
+
+def _indent(text):
+    return '\n'.join('    ' + line if line else '' for line in
+                     text.split('\n'))
+
+
+def generate_page(rnd, number, pagecount, sections=3):
+    """Return markup for a page with the given number of ``##`` sections."""
+    parts = ['# Page %d' % number, _paragraph(rnd, pagecount)]
+    for section in range(sections):
+        parts.append('## Section %d' % section)
+        parts.append('(note-%d)\n' % section + _paragraph(rnd, pagecount))
+        parts.append('* ' + '\n* '.join(
+            _sentence(rnd, pagecount) for _ in range(3)))
+        parts.append('1. ' + '\n2. '.join(
+            _sentence(rnd, pagecount) for _ in range(2)))
+        # every snippet is different, so that Pygments isn't skipped
+        # because of the highlighting cache
+        parts.append('code: python\n' + _indent(_CODE % (number, section)))
+        parts.append('graybox: Note %d\n' % section + _indent(
+            _paragraph(rnd, pagecount) + '\n\nfloatingbox: Inner\n' +
+            _indent(_paragraph(rnd, pagecount))))
+        parts.append('indent:\n' + _indent(_paragraph(rnd, pagecount)))
+        parts.append('redbox: Warning %d\n' % section +
+                     _indent(_paragraph(rnd, pagecount)))
+        parts.append('noparagraph:\n' + _indent(_paragraph(rnd, pagecount)))
+        if section % 2 == 0:
+            parts.append('image: picture.svg')
+        else:
+            parts.append('image: picture.svg\nfloat: right;\nwidth: 10%;')
+        parts.append('### Subsection\n\ncomment: not in the output')
+        parts.append(_paragraph(rnd, pagecount))
+    return '\n\n'.join(parts) + '\n'
+
+
+def generate(directory, pagecount, sections=3, seed=0):
+    """Write *pagecount* ``.txt`` files, ``long.txt``, ``style.css`` and
+    ``picture.svg`` to *directory*.
+
+    ``long.txt`` contains one :func:`long_paragraph`. Returns the total
+    size of the written markup in bytes.
+    """
+    rnd = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    total = 0
+    for number in range(pagecount):
+        markup = generate_page(rnd, number, pagecount, sections)
+        path = os.path.join(directory, 'page%d.txt' % number)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(markup)
+        total += len(markup.encode('utf-8'))
+
+    markup = '# Long Page\n\n' + long_paragraph(rnd, pagecount) + '\n'
+    with open(os.path.join(directory, 'long.txt'), 'w',
+              encoding='utf-8') as file:
+        file.write(markup)
+    total += len(markup.encode('utf-8'))
+
+    with open(os.path.join(directory, 'style.css'), 'w') as file:
+        file.write('body { font-family: sans-serif; }\n')
+    with open(os.path.join(directory, 'picture.svg'), 'w') as file:
+        file.write(_IMAGE)
+    return total
@@ -0,0 +1,245 @@
+"""Measure how fast htmlthingy is.
+
+Run this from anywhere, e.g. ``python3 benchmarks/run.py --pages 500``.
+Use ``--save baseline.json`` to save the results, and later
+``--baseline baseline.json`` to compare against them. With a baseline, the
+exit status is 1 if something got more than ``--threshold`` slower.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+_PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _PROJECT_DIR)
+
+import htmlthingy                   # noqa
+from htmlthingy import linkcheck, tags      # noqa
+
+import corpus                       # noqa
+
+
+@contextlib.contextmanager
+def _quiet():
+    # hide progress bars and other output
+    with contextlib.redirect_stdout(io.StringIO()), \
+            contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+def _measure(function, repeat):
+    """Return (best time in seconds, peak memory in bytes)."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    # tracemalloc makes everything slower, so it's not on while timing
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return (min(times), peak)
+
+
+# this runs in a new python process, because modules are imported only once
+_IMPORT_CODE = """
+import sys, time
+sys.path.insert(0, %r)
+start = time.perf_counter()
+import htmlthingy
+''.join(htmlthingy.MarkupConverter().convert('**Hello** [World](x.html)'))
+print(time.perf_counter() - start)
+print(' '.join(name for name in ['tqdm', 'pygments', 'htmlthingy._run']
+               if name in sys.modules))
+"""
+
+
+def measure_import(repeat):
+    """Return (best time in seconds, slow modules that got imported).
+
+    The time is for importing htmlthingy and converting a short string,
+    which is all that e.g. a small preview script does.
+    """
+    times = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', _IMPORT_CODE % _PROJECT_DIR],
+            universal_newlines=True)
+        seconds, modules = output.split('\n')[:2]
+        times.append(float(seconds))
+    return (min(times), modules.split())
+
+
+def run_benchmarks(directory, pagecount, sections, repeat, jobs):
+    size = corpus.generate(directory, pagecount, sections)
+    markups = []
+    for name in ['page%d.txt' % number for number in range(pagecount)] + [
+            'long.txt']:
+        with open(os.path.join(directory, name), 'r',
+                  encoding='utf-8') as file:
+            markups.append(file.read())
+    pagecount = len(markups)
+    long_paragraph = markups[-1].split('\n\n', 1)[1]
+
+    blocks = [block for markup in markups[:-1]
+              for block in re.split(r'\n\n(?=\S)', markup)]
+    paragraphs = [block for block in blocks if block[:1].isalpha() and
+                  not re.match(r'^\w+:', block)]
+    codes = [block.split('\n', 1)[1] for block in blocks
+             if block.startswith('code:')]
+    converter = htmlthingy.MarkupConverter()
+
+    def convert():
+        for markup in markups:
+            ''.join(converter.convert(markup))
+
+    def convert_chunk():
+        for paragraph in paragraphs:
+            ''.join(converter.convert_chunk(paragraph, '<string>'))
+
+    def convert_long_paragraph():
+        ''.join(converter.convert_chunk(long_paragraph, '<string>'))
+
+    def multiline_code():
+        tags._highlight.cache_clear()
+        for code in codes:
+            tags.multiline_code(code, 'python', 'default')
+
+    def build():
+        builder = htmlthingy.Builder(jobs=jobs)
+        with _quiet():
+            builder.run()
+
+    def check_links():
+        with _quiet():
+            linkcheck.run('html')
+
+    stages = [
+        ('convert', convert, pagecount, size),
+        ('convert_chunk', convert_chunk, None,
+         sum(len(p.encode('utf-8')) for p in paragraphs)),
+        ('long_paragraph', convert_long_paragraph, None,
+         len(long_paragraph.encode('utf-8'))),
+        ('multiline_code', multiline_code, None,
+         sum(len(c.encode('utf-8')) for c in codes)),
+        ('Builder.run', build, pagecount, size),
+        ('linkcheck.run', check_links, pagecount, None),
+    ]
+
+    results = {'pages': pagecount, 'bytes': size, 'stages': {}}
+    seconds, modules = measure_import(max(repeat, 5))
+    results['stages']['import'] = {'seconds': seconds,
+                                   'unexpected_imports': modules}
+    old_cwd = os.getcwd()
+    os.chdir(directory)     # Builder and linkcheck use relative paths
+    try:
+        for name, function, pages, nbytes in stages:
+            seconds, peak = _measure(function, repeat)
+            result = {'seconds': seconds, 'peak_memory_mb': peak / 2**20}
+            if pages is not None:
+                result['pages_per_second'] = pages / seconds
+            if nbytes is not None:
+                result['mb_per_second'] = nbytes / 2**20 / seconds
+            results['stages'][name] = result
+    finally:
+        os.chdir(old_cwd)
+    return results
+
+
+def print_results(results):
+    print("%d pages, %.2f MB of markup" % (results['pages'],
+                                           results['bytes'] / 2**20))
+    unexpected = results['stages']['import']['unexpected_imports']
+    if unexpected:
+        print("Warning: importing htmlthingy also imported %s"
+              % ', '.join(unexpected))
+    print("%-16s %10s %10s %10s %10s" % (
+        'stage', 'seconds', 'pages/s', 'MB/s', 'peak MB'))
+    for name, result in results['stages'].items():
+        print("%-16s %10.3f %10s %10s %10s" % (
+            name, result['seconds'],
+            '%.1f' % result['pages_per_second']
+            if 'pages_per_second' in result else '-',
+            '%.2f' % result['mb_per_second']
+            if 'mb_per_second' in result else '-',
+            '%.1f' % result['peak_memory_mb']
+            if 'peak_memory_mb' in result else '-'))
+
+
+def find_regressions(results, baseline, threshold):
+    """Return a list of messages about stages that got slower."""
+    messages = []
+    for name, old in baseline['stages'].items():
+        new = results['stages'].get(name)
+        if new is None:
+            continue
+        if new['seconds'] > old['seconds'] * (1 + threshold):
+            messages.append("%s: %.3fs -> %.3fs (%+.0f%%)" % (
+                name, old['seconds'], new['seconds'],
+                (new['seconds'] / old['seconds'] - 1) * 100))
+
+    old_imports = baseline['stages'].get('import', {}).get(
+        'unexpected_imports', [])
+    for module in results['stages']['import']['unexpected_imports']:
+        if module not in old_imports:
+            messages.append("import: %s is imported now" % module)
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--pages', type=int, default=200,
+                        help="number of pages to generate (default: 200)")
+    parser.add_argument('--sections', type=int, default=3,
+                        help="number of ## sections per page (default: 3)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="run each stage this many times and use the "
+                             "fastest (default: 3)")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="value of Builder(jobs=...) (default: 1)")
+    parser.add_argument('--save', metavar='FILE',
+                        help="write the results to a JSON file")
+    parser.add_argument('--baseline', metavar='FILE',
+                        help="compare against results saved with --save")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="with --baseline, fail if a stage is more "
+                             "than this much slower (default: 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = run_benchmarks(directory, args.pages, args.sections,
+                                 args.repeat, args.jobs)
+    print_results(results)
+
+    if args.save is not None:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        regressions = find_regressions(results, baseline, args.threshold)
+        if regressions:
+            print()
+            print("Slower than %s:" % args.baseline)
+            for message in regressions:
+                print("  " + message)
+            sys.exit(1)
+        print()
+        print("No regressions compared to %s." % args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,14 +3,46 @@ __copyright__ = 'Copyright (c) 2017 Akuli'
 __license__ = 'MIT'
 __version__ = '0.1.0'
 
+import sys
+
 from htmlthingy import tags
 from htmlthingy._converter import MarkupConverter
-from htmlthingy._run import Builder
 
-import tqdm
+#: True to always show progress bars, False to never show anything, or
+#: None to show progress bars only if stderr is a terminal and just print
+#: the messages otherwise.
+progress_bars = None
+
+
+def __getattr__(name):
+    # importing _run is slow, and many scripts only need MarkupConverter
+    if name == 'Builder':
+        from htmlthingy._run import Builder
+        globals()['Builder'] = Builder
+        return Builder
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def _stderr_is_terminal():
+    try:
+        return sys.stderr.isatty()
+    except (AttributeError, ValueError):     # None or closed
+        return False
 
 
 def progressbar(filelist, message):
+    show_bar = progress_bars
+    if show_bar is None:
+        show_bar = _stderr_is_terminal()
+        if not show_bar:
+            # e.g. a CI log, where a progress bar would be a mess
+            print(message + "...", file=sys.stderr)
+    if not show_bar:
+        yield from filelist
+        return
+
+    import tqdm     # slow to import
+
     length = max(50-len(message), 0)
     pbar = tqdm.tqdm(
         filelist, bar_format=('%s{postfix:%d.%d} |{bar}|'
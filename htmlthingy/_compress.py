@@ -0,0 +1,199 @@
+import concurrent.futures
+import gzip
+import os
+import re
+
+import htmlthingy
+from htmlthingy import _sync
+
+# files with these suffixes get compressed siblings
+SUFFIXES = ('.html', '.css', '.js')
+EXTENSIONS = ('.gz', '.br')
+
+# whitespace is left alone inside these
+_RAW_TAG_REGEX = re.compile(r'<(/?)(pre|textarea|script|style)\b[^>]*>',
+                            re.IGNORECASE)
+_WHITESPACE_REGEX = re.compile(r'\s+')
+
+
+def _collapse_whitespace(match):
+    return '\n' if '\n' in match.group(0) else ' '
+
+
+class _Minifier:
+
+    def __init__(self):
+        self._raw_tag = None     # e.g. 'pre' when inside <pre>...</pre>
+
+    def process(self, html):
+        result = []
+        pos = 0
+        for match in _RAW_TAG_REGEX.finditer(html):
+            result.append(self._process_text(html[pos:match.start()]))
+            result.append(match.group(0))
+            pos = match.end()
+
+            closing, tag = match.group(1), match.group(2).lower()
+            if self._raw_tag is None and not closing:
+                self._raw_tag = tag
+            elif self._raw_tag == tag and closing:
+                self._raw_tag = None
+        result.append(self._process_text(html[pos:]))
+        return ''.join(result)
+
+    def _process_text(self, text):
+        if self._raw_tag is not None:
+            return text
+        return _WHITESPACE_REGEX.sub(_collapse_whitespace, text)
+
+
+def minify(pieces):
+    """Collapse whitespace in HTML, except inside ``<pre>`` and friends.
+
+    This takes an iterable of strings and yields strings, so big pages
+    don't need to be in memory all at once.
+
+    >>> ''.join(minify(['<p>a  b\\n\\n  c</p>\\n\\n<pre>x\\n  ', ' y</pre>  ']))
+    '<p>a b\\nc</p>\\n<pre>x\\n   y</pre> '
+    """
+    minifier = _Minifier()
+    carry = ''
+    for piece in pieces:
+        text = carry + piece
+        # a tag or a run of whitespace may continue in the next piece
+        cut = len(text.rstrip())
+        less_than = text.rfind('<', 0, cut)
+        if less_than != -1 and text.find('>', less_than, cut) == -1:
+            cut = less_than
+        carry = text[cut:]
+        yield minifier.process(text[:cut])
+    yield minifier.process(carry)
+
+
+def _compressors():
+    yield ('.gz', lambda data: gzip.compress(data, 9, mtime=0))
+    try:
+        import brotli       # optional dependency
+    except ImportError:
+        return
+    yield ('.br', brotli.compress)
+
+
+def _compress_one(path, compressors):
+    # returns compressed file paths
+    stat = os.stat(path)
+    data = None
+    result = []
+    for extension, compress in compressors:
+        compressed_path = path + extension
+        result.append(compressed_path)
+        try:
+            if os.stat(compressed_path).st_mtime_ns == stat.st_mtime_ns:
+                continue
+        except FileNotFoundError:
+            pass
+
+        if data is None:
+            with open(path, 'rb') as file:
+                data = file.read()
+        _sync.write_file(compressed_path, [compress(data)], encoding=None)
+        # the modification time tells later builds that this is up to date
+        os.utime(compressed_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    return result
+
+
+class CompressingOutput:
+    """Wraps a :class:`htmlthingy.outputs.Output` to compress files.
+
+    Directories are compressed with :func:`precompress` after the build,
+    but e.g. a tar archive can't be read while it's written, so this
+    writes the compressed files at the same time with the original file.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self._compressors = list(_compressors())
+
+    def __getattr__(self, name):
+        return getattr(self.output, name)
+
+    def write(self, path, pieces, encoding='utf-8'):
+        if not path.endswith(SUFFIXES):
+            self.output.write(path, pieces, encoding)
+            return
+
+        if encoding is None:
+            data = b''.join(pieces)
+        else:
+            data = ''.join(pieces).encode(encoding)
+        self.output.write(path, [data], encoding=None)
+        for extension, compress in self._compressors:
+            self.output.write(path + extension, [compress(data)],
+                              encoding=None)
+
+    def remove(self, path):
+        self.output.remove(path)
+        for extension in EXTENSIONS:
+            self.output.remove(path + extension)
+
+    def finish(self):
+        """Compress files that were written without this wrapper.
+
+        Returns the paths of all compressed files.
+        """
+        paths = self.output.paths()
+        existing = set(paths)
+        result = []
+        for path in paths:
+            if path.endswith(SUFFIXES) and not os.path.basename(
+                    path).startswith('.'):
+                missing = [(extension, compress)
+                           for extension, compress in self._compressors
+                           if path + extension not in existing]
+                if missing:
+                    data = self.output.read(path)
+                    for extension, compress in missing:
+                        self.output.write(path + extension, [compress(data)],
+                                          encoding=None)
+                result.extend(path + extension
+                              for extension, compress in self._compressors)
+        return result
+
+
+def precompress(outputdir, message="Compressing files"):
+    """Create a ``.gz`` file next to each HTML, CSS and JS file.
+
+    With the ``brotli`` module installed, ``.br`` files are created too.
+    Files are compressed only if they changed after they were compressed
+    last time, and compressed files of deleted files are deleted.
+    Returns the paths of the compressed files relative to *outputdir*.
+    """
+    paths = []
+    for root, dirs, files in os.walk(outputdir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if name.startswith('.'):
+                # e.g. the manifest or a temporary file
+                continue
+            if name.endswith(SUFFIXES):
+                paths.append(path)
+            elif (name.endswith(EXTENSIONS) and
+                  os.path.splitext(name)[0].endswith(SUFFIXES) and
+                  not os.path.exists(os.path.splitext(path)[0])):
+                os.remove(path)
+
+    compressors = list(_compressors())
+    result = []
+    if paths:
+        # zlib and brotli don't hold the GIL while compressing
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            results = executor.map(
+                lambda path: _compress_one(path, compressors), paths)
+            relative_paths = [os.path.relpath(path, outputdir)
+                              for path in paths]
+            for path, compressed_paths in zip(
+                    htmlthingy.progressbar(relative_paths, message), results):
+                result.extend(os.path.relpath(compressed_path, outputdir)
+                              for compressed_path in compressed_paths)
+    return result
@@ -1,7 +1,555 @@
+import functools
+import hashlib
+import os
 import re
+import signal
 import textwrap
+import threading
+import time
+import types
+import warnings
 
-from htmlthingy import tags
+try:
+    from re import _parser as sre_parse     # python 3.11 or newer
+except ImportError:
+    import sre_parse
+
+from htmlthingy import _tree, tags
+from htmlthingy._profiling import Profiler
+
+
+def _first_chars(parsed):
+    # returns a set of characters that a match of the parsed regex must
+    # start with, or None if that can't be figured out
+    for op, arg in parsed:
+        if op is sre_parse.LITERAL:
+            return {chr(arg)}
+        if op is sre_parse.IN:
+            result = set()
+            for in_op, in_arg in arg:
+                if in_op is sre_parse.LITERAL:
+                    result.add(chr(in_arg))
+                elif in_op is sre_parse.RANGE and in_arg[1] - in_arg[0] < 100:
+                    result.update(map(chr, range(in_arg[0], in_arg[1] + 1)))
+                else:
+                    return None
+            return result
+        if op is sre_parse.SUBPATTERN:
+            add_flags, del_flags, subpattern = arg[-3:]
+            if add_flags & re.IGNORECASE:
+                return None
+            return _first_chars(subpattern)
+        if op is sre_parse.BRANCH:
+            result = set()
+            for branch in arg[1]:
+                branch_chars = _first_chars(branch)
+                if branch_chars is None:
+                    return None
+                result |= branch_chars
+            return result
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            min_count, max_count, subpattern = arg
+            if min_count == 0:
+                return None
+            return _first_chars(subpattern)
+        return None
+    return None
+
+
+def _iter_blocks(lines):
+    r"""Lazy version of ``re.split(r'\n\n(?=\S)', ''.join(lines))``.
+
+    >>> list(_iter_blocks(['a\n', '\n', '\n', 'b\n', '\n', ' c\n', '\n', 'd']))
+    ['a\n', 'b\n\n c', 'd']
+    """
+    block = []
+    for line in lines:
+        if (line[:1].strip() and len(block) >= 2 and block[-1] == '\n'):
+            # the newline at the end of block[-2] belongs to the separator
+            yield ''.join(block[:-1])[:-1]
+            block.clear()
+        block.append(line)
+    yield ''.join(block)
+
+
+def _stable_repr(const):
+    """Like repr(), but the same in every process.
+
+    The order of a frozenset's repr depends on the hash seed, which is
+    different in each process by default.
+
+    >>> _stable_repr((1, frozenset({'b', 'a'})))
+    "(1, frozenset({'a', 'b'}))"
+    """
+    if isinstance(const, tuple):
+        if len(const) == 1:
+            return '(%s,)' % _stable_repr(const[0])
+        return '(%s)' % ', '.join(map(_stable_repr, const))
+    if isinstance(const, (set, frozenset)):
+        return 'frozenset({%s})' % ', '.join(sorted(map(_stable_repr, const)))
+    return repr(const)
+
+
+def _hash_code(code, hasher):
+    hasher.update(code.co_code)
+    hasher.update(repr(code.co_names).encode('utf-8'))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(const, hasher)
+        else:
+            hasher.update(_stable_repr(const).encode('utf-8'))
+
+
+def _looks_before_parsed(parsed):
+    # True if the parsed regex may look at characters before the match
+    for op, arg in parsed:
+        if op is sre_parse.AT:
+            if arg in (sre_parse.AT_END, sre_parse.AT_END_LINE,
+                       sre_parse.AT_END_STRING):
+                continue
+            return True
+        if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            direction, subpattern = arg
+            if direction < 0 or _looks_before_parsed(subpattern):
+                return True
+            continue
+        if op is sre_parse.SUBPATTERN:
+            return _looks_before_parsed(arg[-1])
+        if op is sre_parse.BRANCH:
+            return any(map(_looks_before_parsed, arg[1]))
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            min_count, max_count, subpattern = arg
+            if _looks_before_parsed(subpattern):
+                return True
+            if min_count == 0:
+                continue
+        return False
+    return False
+
+
+# what \b, \B, ^ and \A mean at the start of a string
+_AT_START = {'\\b': r'(?=\w)', '\\B': r'(?!\w)', '^': '', '\\A': ''}
+
+
+@functools.lru_cache(maxsize=None)
+def _at_start_regex(regex):
+    r"""Return a regex for matching at *pos* like at the start of a string.
+
+    ``_at_start_regex(regex).match(string, pos)`` works like
+    ``regex.match(string[pos:])``, but without copying the string. This
+    returns None if *regex* is too complicated for that.
+
+    >>> _at_start_regex(re.compile(r'\b_(.+?)_\b')).pattern
+    '(?=\\w)_(.+?)_\\b'
+    >>> _at_start_regex(re.compile(r'^\*\*'))
+    re.compile('\\*\\*')
+    >>> print(_at_start_regex(re.compile(r'a*\b')))
+    None
+    """
+    prefix = re.match(r'(?:\\[bBA]|\^)*', regex.pattern).group(0)
+    rest = regex.pattern[len(prefix):]
+    if rest[:1] in {'?', '*', '+', '{'}:
+        return None
+    try:
+        if _looks_before_parsed(sre_parse.parse(rest, regex.flags)):
+            return None
+    except Exception:
+        return None
+    pattern = ''.join(_AT_START[assertion] for assertion in
+                      re.findall(r'\\.|\^', prefix)) + rest
+    return re.compile(pattern, regex.flags)
+
+
+@functools.lru_cache(maxsize=None)
+def _looks_before_match(regex):
+    r"""Check if *regex* may see the characters before where it's searched.
+
+    For these regexes, ``regex.search(string, pos)`` and
+    ``regex.search(string[pos:])`` can find different things. This
+    returns ``'start'`` if only a match starting at *pos* can be
+    different and :func:`_at_start_regex` can check that, ``'any'``
+    for other regexes that can find different things, and None if the
+    results are always the same.
+
+    >>> _looks_before_match(re.compile(r'\b_(.+?)_\b'))
+    'start'
+    >>> _looks_before_match(re.compile(r'x(?<!yx)'))
+    'any'
+    >>> _looks_before_match(re.compile(r'``(.+?)``\b')) is None
+    True
+    """
+    # a lookbehind can look further back than other assertions, which
+    # only look at the character right before them
+    if re.search(r'\(\?<[=!]', regex.pattern):
+        return 'any'
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except Exception:
+        return 'any'
+    if not _looks_before_parsed(parsed):
+        return None
+    if _at_start_regex(regex) is None:
+        return 'any'
+    return 'start'
+
+
+def _anchored_first_chars(regex):
+    """Find the characters that a chunk must start with to match *regex*.
+
+    Returns None for regexes that don't begin with ``^``, and for
+    anything too complicated to figure out.
+
+    >>> sorted(_anchored_first_chars(re.compile(r'^(gray|red)box:')))
+    ['g', 'r']
+    >>> print(_anchored_first_chars(re.compile(r'hello')))
+    None
+    """
+    if regex.flags & (re.MULTILINE | re.IGNORECASE):
+        return None
+    try:
+        parsed = list(sre_parse.parse(regex.pattern, regex.flags))
+    except Exception:
+        return None
+    if not parsed or parsed[0] != (sre_parse.AT, sre_parse.AT_BEGINNING):
+        return None
+    return _first_chars(parsed[1:])
+
+
+def _lint_parsed(parsed, in_repeat, problems):
+    items = list(parsed)
+    for index, (op, arg) in enumerate(items):
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            min_count, max_count, subpattern = arg
+            if in_repeat and max_count > 1:
+                problems.append("nested quantifiers, like (a+)+")
+            unbounded = (max_count == sre_parse.MAXREPEAT)
+            if unbounded and index + 1 < len(items):
+                next_op, next_arg = items[index + 1]
+                if (next_op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+                        and next_arg[1] == sre_parse.MAXREPEAT
+                        and list(next_arg[2]) == list(subpattern)):
+                    problems.append(
+                        "two quantifiers for the same thing, like \\s*\\s*")
+            _lint_parsed(subpattern, in_repeat or unbounded, problems)
+        elif op is sre_parse.SUBPATTERN:
+            _lint_parsed(arg[-1], in_repeat, problems)
+        elif op is sre_parse.BRANCH:
+            if in_repeat:
+                seen = set()
+                for branch in arg[1]:
+                    chars = _first_chars(branch)
+                    if chars is None:
+                        continue
+                    if seen & chars:
+                        problems.append("repeated alternatives that can "
+                                        "start with the same character")
+                        break
+                    seen |= chars
+                # sre_parse moves the common beginning of the
+                # alternatives out of them, so (a|a) becomes a(?:|)
+                branches = [list(branch) for branch in arg[1]]
+                if any(branch in branches[:index]
+                       for index, branch in enumerate(branches)):
+                    problems.append("repeated alternatives that can "
+                                    "start with the same character")
+            for branch in arg[1]:
+                _lint_parsed(branch, in_repeat, problems)
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            _lint_parsed(arg[1], in_repeat, problems)
+
+
+def _lint_regex(regex):
+    r"""Return a list of reasons why *regex* may backtrack catastrophically.
+
+    Matching these can take exponential time when the text almost
+    matches, so one bad paragraph can make a build take forever.
+
+    >>> _lint_regex(re.compile(r'\*\*(.+?)\*\*'))
+    []
+    >>> _lint_regex(re.compile(r'<(\w+\s?)*>'))
+    ['nested quantifiers, like (a+)+']
+    >>> _lint_regex(re.compile(r'(a|a)*'))
+    ['repeated alternatives that can start with the same character']
+    """
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except Exception:
+        return []
+    problems = []
+    _lint_parsed(parsed, False, problems)
+    return list(dict.fromkeys(problems))
+
+
+def _lint_and_warn(regex):
+    for problem in _lint_regex(regex):
+        # stacklevel points to the add_inliner() or add_multiliner() call
+        warnings.warn("regex %r may be very slow to match: %s"
+                      % (regex.pattern, problem), stacklevel=3)
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+# the re module checks for signals while matching, so a SIGALRM can
+# interrupt a search that would otherwise take forever, but that's
+# possible only in the main thread and not on windows
+#
+# setting up the signal handler and the timer for each search would be
+# slow, so the timer is left running between searches, and the handler
+# starts it again if a search is running but still has time left
+_alarm_search = None        # (budget, start time) while searching
+_alarm_deadline = None      # when the timer goes off, or None if it's off
+_alarm_old_handler = None   # None if _on_alarm isn't the handler
+
+
+def _stop_alarm():
+    # the handler is set only while the timer is running
+    global _alarm_deadline, _alarm_old_handler
+    signal.setitimer(signal.ITIMER_REAL, 0)
+    signal.signal(signal.SIGALRM, _alarm_old_handler)
+    _alarm_deadline = None
+    _alarm_old_handler = None
+
+
+def _on_alarm(signum, frame):
+    global _alarm_deadline
+    _alarm_deadline = None
+    if _alarm_search is None:
+        # no more searches for now, e.g. the build is done
+        _stop_alarm()
+        return
+    budget, start = _alarm_search
+    seconds_left = budget.seconds_left(start)
+    if seconds_left <= 0:
+        raise _OutOfTime
+    _start_alarm(seconds_left)
+
+
+def _start_alarm(seconds):
+    global _alarm_deadline
+    _alarm_deadline = time.perf_counter() + seconds
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+
+
+def _reset_alarm_in_child():
+    # timers don't survive a fork, e.g. in FrozenConverter.convert_many()
+    if _alarm_old_handler is not None:
+        _stop_alarm()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_alarm_in_child)
+
+
+def _alarm_available():
+    # checks whether the SIGALRM handler is or can be _on_alarm
+    global _alarm_old_handler
+    if (not hasattr(signal, 'setitimer') or
+            threading.current_thread() is not threading.main_thread()):
+        return False
+    if _alarm_old_handler is not None:
+        return True
+    if signal.getitimer(signal.ITIMER_REAL) != (0.0, 0.0):
+        # something else is using the timer
+        return False
+    _alarm_old_handler = (signal.signal(signal.SIGALRM, _on_alarm) or
+                          signal.SIG_DFL)
+    return True
+
+
+class _Budget:
+    # measures the time spent on searching regexes in one chunk, see
+    # MarkupConverter.match_budget
+
+    def __init__(self, converter, chunk, filename):
+        self._converter = converter
+        self._chunk = chunk
+        self._filename = filename
+        self._seconds = 0.0
+        self._use_alarm = _alarm_available()
+
+    def seconds_left(self, start):
+        # start is when the current search started
+        return (self._converter.match_budget - self._seconds -
+                (time.perf_counter() - start))
+
+    def search(self, regex, pos, sliced=None):
+        # with sliced='search', this searches chunk[pos:], and with
+        # sliced='match', it matches at pos like chunk[pos:] would match
+        global _alarm_search
+        budget = self._converter.match_budget
+        if self._use_alarm and _alarm_deadline is None:
+            # _on_alarm() may have put back the old handler
+            self._use_alarm = _alarm_available()
+        use_alarm = self._use_alarm
+
+        start = time.perf_counter()
+        try:
+            if use_alarm:
+                _alarm_search = (self, start)
+                if (_alarm_deadline is None or
+                        _alarm_deadline > start + budget - self._seconds):
+                    _start_alarm(max(budget - self._seconds, 0.001))
+            if sliced == 'match':
+                match = _at_start_regex(regex).match(self._chunk, pos)
+            elif sliced == 'search':
+                match = regex.search(self._chunk[pos:])
+            else:
+                match = regex.search(self._chunk, pos)
+        except _OutOfTime:
+            match = None
+            self._seconds = budget
+        finally:
+            if use_alarm:
+                _alarm_search = None
+                if _alarm_deadline is None:
+                    _stop_alarm()
+        self._seconds += time.perf_counter() - start
+
+        if self._seconds > budget:
+            handler = (self._converter._inliners.get(regex) or
+                       self._converter._multiliners.get(regex))
+            handler = getattr(handler, '__wrapped__', handler)
+            raise ValueError(
+                f"matching regexes took more than {budget} seconds in "
+                f"{self._filename}, handler "
+                f"{getattr(handler, '__name__', handler)} with regex "
+                f"{regex.pattern!r} at offset {pos} of this markup:"
+                f"\n\n{self._chunk[pos:pos+200]}")
+        return match
+
+
+class _HtmlOutput:
+    # built-in handlers write to this or _NodeOutput, so that the same
+    # function works with convert(), convert_into() and parse()
+    #
+    # with generators=True, nested markup is converted with convert() and
+    # convert_chunk(), because enable_profiling() wraps those
+
+    __slots__ = ('_converter', '_filename', '_generators', 'write')
+
+    def __init__(self, converter, filename, write, generators=False):
+        self._converter = converter
+        self._filename = filename
+        self._generators = generators
+        self.write = write
+
+    def _inline(self, markup, write):
+        if self._generators:
+            for piece in self._converter.convert_chunk(markup,
+                                                       self._filename):
+                write(piece)
+        else:
+            self._converter._convert_chunk_into(markup, self._filename,
+                                                write)
+
+    def _blocks(self, markup, write):
+        if self._generators:
+            for piece in self._converter.convert(markup, self._filename):
+                write(piece)
+        else:
+            self._converter.convert_into(markup, write, self._filename)
+
+    def inline(self, markup):
+        self._inline(markup, self.write)
+
+    def blocks(self, markup):
+        self._blocks(markup, self.write)
+
+    def start(self, tag, attrs=None):
+        attrs = attrs or {}
+        if 'id' in attrs:
+            self._converter.record_id(self._filename, attrs['id'])
+        if tag == 'a' and 'href' in attrs:
+            self._converter.record_link(self._filename, attrs['href'])
+        self.write('<%s%s>' % (tag, ''.join(
+            ' %s="%s"' % item for item in attrs.items())))
+
+    def end(self, tag):
+        self.write('</%s>' % tag)
+
+    def title(self, level, markup, id_=None):
+        pieces = []
+        self._inline(markup, pieces.append)
+        content = ''.join(pieces)
+        if id_ is None:
+            id_ = tags._id_ify(content)
+        self._converter.record_id(self._filename, id_)
+        self.write(tags.title(content, level, id_))
+
+    def code(self, code, lexer_name):
+        self.write(tags.multiline_code(
+            code, lexer_name, self._converter.pygments_style,
+            noclasses=not self._converter.pygments_classes,
+            cache_dir=self._converter.highlight_cache_dir))
+
+    def add_id(self, id_, markup):
+        pieces = []
+        self._blocks(markup, pieces.append)
+
+        # only the first tag changes, no need to join everything
+        while pieces and not pieces[0].strip():
+            del pieces[0]
+        regex = re.compile(r'^<(\w+)')      # fuck stackoverflow
+        if pieces and regex.search(pieces[0].lstrip()) is not None:
+            first = pieces[0].lstrip()
+        else:
+            # the first tag is split into many pieces
+            first = ''.join(pieces).lstrip()
+            pieces = [first]
+        assert regex.search(first) is not None, "cannot use (...) here"
+        self._converter.record_id(self._filename, id_)
+        self.write(regex.sub(r'<\1 id="%s"' % id_, first, count=1))
+        for piece in pieces[1:]:
+            self.write(piece)
+
+
+class _NodeOutput:
+    # like _HtmlOutput, but creates nodes for MarkupConverter.parse()
+
+    __slots__ = ('_converter', '_filename', 'nodes', '_parents')
+
+    def __init__(self, converter, filename):
+        self._converter = converter
+        self._filename = filename
+        self.nodes = []
+        self._parents = []      # lists of nodes that contain self.nodes
+
+    def write(self, html):
+        self.nodes.append(_tree.Raw(html))
+
+    def inline(self, markup):
+        self.nodes.extend(self._converter.parse_chunk(markup, self._filename))
+
+    def blocks(self, markup):
+        self.nodes.extend(
+            self._converter.parse(markup, self._filename).children)
+
+    def start(self, tag, attrs=None):
+        element = _tree.Element(tag, dict(attrs or {}), [])
+        self.nodes.append(element)
+        self._parents.append(self.nodes)
+        self.nodes = element.children
+
+    def end(self, tag):
+        self.nodes = self._parents.pop()
+
+    def title(self, level, markup, id_=None):
+        self.nodes.append(_tree.Title(
+            level, self._converter.parse_chunk(markup, self._filename), id_))
+
+    def code(self, code, lexer_name):
+        # the style isn't known when parsing
+        self.nodes.append(_tree.Code(code, lexer_name))
+
+    def add_id(self, id_, markup):
+        nodes = self._converter.parse(markup, self._filename).children
+        if nodes and isinstance(nodes[0], (_tree.Element, _tree.Title)):
+            nodes[0].set_id(id_)
+            self.nodes.extend(nodes)
+        else:
+            self.nodes.append(_tree.AddId(id_, nodes))
 
 
 class MarkupConverter:
@@ -34,9 +582,28 @@ class MarkupConverter:
 
     def __init__(self):
         self.pygments_style = 'default'
+        self.pygments_classes = False
+        self.highlight_cache_dir = None
+        # {filename: (ids, link_targets, dependencies)}, or None to not
+        # record anything
+        self.link_records = None
+        self.profiler = None
         self._inliners = {}
+        self._inliner_regexes = ()
         self._multiliners = {}
+        self._multiliner_index = {}     # {first_character: [regex, ...]}
+        self._unindexed_multiliners = []
+        # {handler: function(match, filename, output)} for built-in
+        # handlers, see _builtin_inliner()
+        self._output_handlers = {}
+        # if not None, matching regexes against one paragraph or other
+        # chunk of markup may take at most this many seconds, but a search
+        # can be interrupted only in the main thread, see _Budget
+        self.match_budget = None
         self._add_basic_stuff()
+        # freeze() uses this for finding custom handlers
+        self._builtin_handlers = frozenset(
+            list(self._inliners.values()) + list(self._multiliners.values()))
 
     def convert(self, string, filename='<string>'):
         """Produce output from an input string.
@@ -59,15 +626,52 @@ class MarkupConverter:
         Use ``''.join(converter.convert(contents))`` if you want the
         output as a string.
         """
-        for chunk in re.split(r'\n\n(?=\S)', string):
-            matches = {regex.search(chunk.strip('\n') + '\n')
-                       for regex in self._multiliners} - {None}
-            if len(matches) > 1:
-                # TODO: better error
-                raise ValueError(f"ambiguous markup in {filename}\n\n{chunk}")
+        return self._convert_blocks(re.split(r'\n\n(?=\S)', string),
+                                    filename)
+
+    def convert_stream(self, file, filename='<string>'):
+        """Like :meth:`convert`, but reads the markup from a file object.
+
+        The file is read lazily, so the whole markup is never in memory
+        at once. This is useful for huge input files::
+
+            with open('input.txt', 'r', encoding='utf-8') as infile, \\
+                    open('output.html', 'w', encoding='utf-8') as outfile:
+                for chunk in converter.convert_stream(infile, 'input.txt'):
+                    outfile.write(chunk)
+
+        >>> import io
+        >>> print(''.join(MarkupConverter().convert_stream(
+        ...     io.StringIO('**Hello**\\n\\nWorld\\n'))))
+        <p><b>Hello</b></p>
+        <BLANKLINE>
+        <p>World
+        </p>
+        <BLANKLINE>
+        <BLANKLINE>
+        """
+        return self._convert_blocks(_iter_blocks(file), filename)
 
-            if matches:
-                [match] = matches
+    def _find_multiliner(self, chunk, filename):
+        stripped = chunk.strip('\n') + '\n'
+        candidates = self._multiliner_index.get(stripped[0], [])
+        if self.match_budget is None:
+            matches = {regex.search(stripped)
+                       for regex in candidates + self._unindexed_multiliners}
+        else:
+            budget = _Budget(self, stripped, filename)
+            matches = {budget.search(regex, 0)
+                       for regex in candidates + self._unindexed_multiliners}
+        matches.discard(None)
+        if len(matches) > 1:
+            # TODO: better error
+            raise ValueError(f"ambiguous markup in {filename}\n\n{chunk}")
+        return matches.pop() if matches else None
+
+    def _convert_blocks(self, blocks, filename):
+        for chunk in blocks:
+            match = self._find_multiliner(chunk, filename)
+            if match is not None:
                 yield from self._multiliners[match.re](match, filename)
             elif chunk.strip():
                 yield '<p>'
@@ -81,24 +685,285 @@ class MarkupConverter:
 
         Use this instead of :meth:`convert` if you want to parse nested
         markup, like ``**a [link](something) inside bold**``.
+
+        >>> ''.join(MarkupConverter().convert_chunk('_u_**b**', '<string>'))
+        '<u>u</u><b>b</b>'
         """
-        while chunk:
-            matches = {regex.search(chunk)
-                       for regex in self._inliners} - {None}
+        for text, regex, match in self._scan_inline(chunk, filename):
+            yield text
+            if match is not None:
+                yield self._inliners[regex](match, filename)
+
+    def _scan_inline(self, chunk, filename):
+        # yields (text, regex, match) tuples, where text is the markup
+        # before the match, and finally (text, None, None) with the text
+        # after the last match. The regex is one of self._inliner_regexes,
+        # and match.re may be a regex from _at_start_regex() instead.
+        #
+        # every regex remembers its next match, and it's searched again
+        # only when the cursor has moved past that, so each regex scans
+        # the chunk about once instead of once per match
+        #
+        # the rest of the chunk used to be sliced off for each search, so
+        # regexes like \B\*\*(.+?)\*\*\B must not see the character before
+        # the cursor. Only a match that starts at the cursor can be
+        # different, so that is checked separately with _at_start_regex().
+        # A lookbehind can look further back, so those regexes are always
+        # searched from chunk[pos:].
+        if self.match_budget is None:
+            def search(regex, pos, sliced=None):
+                if sliced == 'match':
+                    return _at_start_regex(regex).match(chunk, pos)
+                if sliced == 'search':
+                    return regex.search(chunk[pos:])
+                return regex.search(chunk, pos)
+        else:
+            search = _Budget(self, chunk, filename).search
+
+        def found_at(pos, match):
+            # returns (start, end, match) with offsets of chunk, or None
+            if match is None:
+                return None
+            return (pos + match.start(), pos + match.end(), match)
+
+        def find(regex, pos):
+            kind = _looks_before_match(regex)
+            if kind == 'any':
+                return found_at(pos, search(regex, pos, 'search'))
+            if kind == 'start' and pos > 0:
+                found = found_at(0, search(regex, pos, 'match'))
+                if found is not None:
+                    return found
+                pos += 1
+            return found_at(0, search(regex, pos))
+
+        # these can find a different match at the cursor when it moves
+        cursor_regexes = [regex for regex in self._inliner_regexes
+                          if _looks_before_match(regex) is not None]
+        upcoming = {regex: find(regex, 0) for regex in self._inliner_regexes}
+        pos = 0
+
+        while pos < len(chunk):
+            for regex, found in upcoming.items():
+                if found is not None and found[0] < pos:
+                    upcoming[regex] = find(regex, pos)
+
+            matches = [(regex, found) for regex, found in upcoming.items()
+                       if found is not None]
             if not matches:
-                yield chunk
+                yield (chunk[pos:], None, None)
                 break
 
-            min_start = min(m.start() for m in matches)
-            firsts = [m for m in matches if m.start() == min_start]
+            min_start = min(found[0] for regex, found in matches)
+            firsts = [(regex, found) for regex, found in matches
+                      if found[0] == min_start]
             if len(firsts) > 1:
                 # TODO: better error
                 raise ValueError(f"ambiguous markup in {filename}\n\n{chunk[min_start:]}")
 
-            match = firsts[0]
-            yield chunk[:min_start]
-            yield self._inliners[match.re](match, filename)
-            chunk = chunk[match.end():]
+            regex, (start, end, match) = firsts[0]
+            yield (chunk[pos:start], regex, match)
+            pos = end
+            if pos >= len(chunk):
+                continue
+            for regex in cursor_regexes:
+                found = upcoming[regex]
+                if (_looks_before_match(regex) == 'start' and
+                        (found is None or found[0] > pos)):
+                    # the remembered match is still the first one after
+                    # the cursor, but there may be a match at the cursor
+                    match = search(regex, pos, 'match')
+                    if match is not None:
+                        upcoming[regex] = found_at(0, match)
+                else:
+                    upcoming[regex] = find(regex, pos)
+
+    def convert_into(self, string, write, filename='<string>'):
+        """Like :meth:`convert`, but calls *write* with each piece of HTML.
+
+        *write* can be e.g. the ``append`` method of a list or the
+        ``write`` method of a file. This is faster than :meth:`convert`,
+        because the built-in handlers write nested markup directly
+        instead of creating generators and joining strings. Custom
+        handlers work as usual.
+
+        >>> pieces = []
+        >>> MarkupConverter().convert_into('**Hello**', pieces.append)
+        >>> ''.join(pieces)
+        '<p><b>Hello</b></p>\\n\\n'
+        """
+        self._convert_blocks_into(re.split(r'\n\n(?=\S)', string), filename,
+                                  write)
+
+    def convert_stream_into(self, file, write, filename='<string>'):
+        """Like :meth:`convert_stream`, but works like :meth:`convert_into`.
+        """
+        self._convert_blocks_into(_iter_blocks(file), filename, write)
+
+    def _convert_blocks_into(self, blocks, filename, write):
+        for chunk in blocks:
+            match = self._find_multiliner(chunk, filename)
+            if match is not None:
+                handler = self._multiliners[match.re]
+                function = self._output_handlers.get(handler)
+                if function is None:
+                    for piece in handler(match, filename):
+                        write(piece)
+                else:
+                    function(match, filename,
+                             _HtmlOutput(self, filename, write))
+            elif chunk.strip():
+                write('<p>')
+                self._convert_chunk_into(chunk, filename, write)
+                write('</p>\n\n')
+
+    def _convert_chunk_into(self, chunk, filename, write):
+        for text, regex, match in self._scan_inline(chunk, filename):
+            write(text)
+            if match is None:
+                continue
+
+            handler = self._inliners[regex]
+            function = self._output_handlers.get(handler)
+            if function is None:
+                write(handler(match, filename))
+            else:
+                function(match, filename, _HtmlOutput(self, filename, write))
+
+    def parse(self, string, filename='<string>'):
+        """Like :meth:`convert`, but returns a tree of nodes.
+
+        The tree is a :class:`htmlthingy._tree.Fragment` and it can be
+        turned into HTML with :meth:`render`, possibly many times and
+        with different :attr:`pygments_style` values. Trees can be
+        pickled, so they can be cached on disk.
+
+        The built-in markup creates nodes like
+        :class:`htmlthingy._tree.Element`, and output of custom
+        handlers goes to :class:`htmlthingy._tree.Raw` nodes. The HTML
+        is the same as with :meth:`convert`, except that ``(id)``
+        before a title doesn't create two ``id`` attributes.
+
+        >>> converter = MarkupConverter()
+        >>> tree = converter.parse('**Hello**')
+        >>> tree
+        Fragment([Element('p', {}, [Element('b', {}, [Raw('Hello')])]), Raw('\\n\\n')])
+        >>> ''.join(converter.render(tree))
+        '<p><b>Hello</b></p>\\n\\n'
+        """
+        return _tree.Fragment(list(self._parse_blocks(
+            re.split(r'\n\n(?=\S)', string), filename)))
+
+    def _parse_blocks(self, blocks, filename):
+        for chunk in blocks:
+            match = self._find_multiliner(chunk, filename)
+            if match is not None:
+                handler = self._multiliners[match.re]
+                function = self._output_handlers.get(
+                    getattr(handler, '__wrapped__', handler))
+                if function is None:
+                    yield _tree.Raw(''.join(handler(match, filename)))
+                else:
+                    output = _NodeOutput(self, filename)
+                    function(match, filename, output)
+                    yield from output.nodes
+            elif chunk.strip():
+                yield _tree.Element('p', {}, self.parse_chunk(chunk, filename))
+                yield _tree.Raw('\n\n')
+
+    def parse_chunk(self, chunk, filename):
+        """Like :meth:`convert_chunk`, but returns a list of nodes."""
+        result = []
+        for text, regex, match in self._scan_inline(chunk, filename):
+            if text or match is None:
+                result.append(_tree.Raw(text))
+            if match is None:
+                continue
+
+            handler = self._inliners[regex]
+            function = self._output_handlers.get(
+                getattr(handler, '__wrapped__', handler))
+            if function is None:
+                result.append(_tree.Raw(handler(match, filename)))
+            else:
+                output = _NodeOutput(self, filename)
+                function(match, filename, output)
+                result.extend(output.nodes)
+        return result
+
+    def render(self, tree, filename='<string>'):
+        """Yield pieces of HTML from a tree returned by :meth:`parse`."""
+        return tree.render(self, filename)
+
+    def _builtin_inliner(self, regex):
+        # decorator for built-in handlers that take an _HtmlOutput or a
+        # _NodeOutput as a third argument, this adds a handler that works
+        # like handlers given to add_inliner()
+        def inner(function):
+            def handler(match, filename):
+                pieces = []
+                function(match, filename, _HtmlOutput(
+                    self, filename, pieces.append, generators=True))
+                return ''.join(pieces)
+
+            handler.__name__ = handler.__qualname__ = function.__name__
+            self._output_handlers[handler] = function
+            return self.add_inliner(regex)(handler)
+
+        return inner
+
+    def _builtin_multiliner(self, regex):
+        # like _builtin_inliner(), but for add_multiliner()
+        def inner(function):
+            def handler(match, filename):
+                pieces = []
+                function(match, filename, _HtmlOutput(
+                    self, filename, pieces.append, generators=True))
+                yield from pieces
+
+            handler.__name__ = handler.__qualname__ = function.__name__
+            self._output_handlers[handler] = function
+            return self.add_multiliner(regex)(handler)
+
+        return inner
+
+    def record_id(self, filename, id_):
+        """Tell :mod:`htmlthingy.linkcheck` that the output has an ``id``.
+
+        Handlers that create ``id`` attributes should call this, and
+        the ``filename`` should be the same as the handler got. The
+        recorded ids are the same that :mod:`htmlthingy.linkcheck` finds
+        from the HTML:
+
+        >>> from htmlthingy import linkcheck
+        >>> converter = MarkupConverter()
+        >>> converter.link_records = {}
+        >>> html = ''.join(converter.convert('(x)\\n# Title'))
+        >>> converter.link_records['<string>'][0]
+        ['x']
+        >>> linkcheck.find_ids_and_links(html)[0]
+        ['x']
+        """
+        if self.link_records is not None:
+            self.link_records.setdefault(filename, ([], [], []))[0].append(id_)
+
+    def record_link(self, filename, target):
+        """Like :meth:`record_id`, but for ``<a href="target">`` links."""
+        if self.link_records is not None:
+            self.link_records.setdefault(
+                filename, ([], [], []))[1].append(target)
+
+    def record_dependency(self, filename, path):
+        """Tell :class:`htmlthingy.Builder` that the output uses a file.
+
+        Handlers and Builder methods like ``get_sidebar_content`` that
+        read other files than the page's own input file should call
+        this, so that incremental builds convert the page again when
+        the file at *path* changes.
+        """
+        if self.link_records is not None:
+            self.link_records.setdefault(
+                filename, ([], [], []))[2].append(path)
 
     def add_inliner(self, regex):
         """Add a new non-multiline processor function.
@@ -118,9 +983,14 @@ class MarkupConverter:
         """
         if isinstance(regex, str):
             regex = re.compile(regex)
+        _lint_and_warn(regex)
 
         def inner(function):
-            self._inliners[regex] = function
+            if self.profiler is None:
+                self._inliners[regex] = function
+            else:
+                self._inliners[regex] = self.profiler.wrap_inliner(function)
+            self._inliner_regexes = tuple(self._inliners)
             return function
 
         return inner
@@ -137,65 +1007,154 @@ class MarkupConverter:
         """
         if isinstance(regex, str):
             regex = re.compile(regex)
+        _lint_and_warn(regex)
 
         def inner(function):
-            self._multiliners[regex] = function
+            if self.profiler is None:
+                self._multiliners[regex] = function
+            else:
+                self._multiliners[regex] = self.profiler.wrap_multiliner(
+                    function)
+            self._update_multiliner_index()
             return function
 
         return inner
 
+    def freeze(self):
+        """Return a :class:`FrozenConverter` with the current handlers.
+
+        Changing this converter doesn't affect the frozen converter.
+        """
+        return FrozenConverter(self)
+
+    def enable_profiling(self):
+        """Start measuring how much time each handler takes.
+
+        This returns a :class:`htmlthingy._profiling.Profiler` that is
+        also available as the ``profiler`` attribute. Profiling makes
+        converting slower, so it's not enabled by default.
+        """
+        if self.profiler is None:
+            self.profiler = Profiler()
+            for regex, function in self._inliners.items():
+                self._inliners[regex] = self.profiler.wrap_inliner(function)
+            for regex, function in self._multiliners.items():
+                self._multiliners[regex] = self.profiler.wrap_multiliner(
+                    function)
+
+            # instance attributes take precedence over methods
+            self.convert_chunk = self.profiler.wrap_converting_method(
+                self.convert_chunk)
+            self._convert_blocks = self.profiler.wrap_converting_method(
+                self._convert_blocks)
+        return self.profiler
+
+    def _fingerprint(self):
+        # this changes when regexes or handler functions are added, removed
+        # or edited, and it's used for figuring out whether old output
+        # files can be reused
+        hasher = hashlib.sha1(repr(
+            (self.pygments_style, self.pygments_classes)).encode('utf-8'))
+        hasher.update(self._parse_fingerprint().encode('ascii'))
+        return hasher.hexdigest()
+
+    def _parse_fingerprint(self):
+        # like _fingerprint(), but for things that affect parse() output
+        hasher = hashlib.sha1()
+        for handlers in [self._inliners, self._multiliners]:
+            hasher.update(b'\0')
+            for regex, function in handlers.items():
+                hasher.update(repr((regex.pattern, regex.flags)).encode('utf-8'))
+                # ignore wrappers added by enable_profiling()
+                function = getattr(function, '__wrapped__', function)
+                for function in [function,
+                                 self._output_handlers.get(function)]:
+                    code = getattr(function, '__code__', None)
+                    if code is None:
+                        # repr() of most callables contains an id(), use
+                        # the type instead
+                        hasher.update(
+                            type(function).__qualname__.encode('utf-8'))
+                    else:
+                        _hash_code(code, hasher)
+        return hasher.hexdigest()
+
+    def _update_multiliner_index(self):
+        # most multiliner regexes look like '^something', and there's no
+        # need to try them on chunks that start with something else
+        self._multiliner_index.clear()
+        self._unindexed_multiliners.clear()
+        for regex in self._multiliners:
+            first_chars = _anchored_first_chars(regex)
+            if first_chars is None:
+                self._unindexed_multiliners.append(regex)
+            else:
+                for char in first_chars:
+                    self._multiliner_index.setdefault(char, []).append(regex)
+
     def _add_basic_stuff(self):
-        @self.add_multiliner(r'^(#{1,5})\s*(.*)$')
-        def title_handler(match, filename):
-            content = ''.join(self.convert_chunk(match.group(2), filename))
-            yield tags.title(content, len(match.group(1)))
+        @self._builtin_multiliner(r'^(#{1,5})\s*(.*)$')
+        def title_handler(match, filename, output):
+            output.title(len(match.group(1)), match.group(2))
+
+        def find_title(markup, filename):
+            # titles already have an id, so (...) must replace it instead
+            # of adding another id attribute
+            title_match = self._find_multiliner(markup, filename)
+            if title_match is None:
+                return None
+            handler = self._multiliners[title_match.re]
+            if getattr(handler, '__wrapped__', handler) is not title_handler:
+                return None
+            return title_match
 
-        @self.add_multiliner(r'^\(([\w-]+)\)\n')
-        def id_adder(match, filename):
+        @self._builtin_multiliner(r'^\(([\w-]+)\)\n')
+        def id_adder(match, filename, output):
             markup = match.string[match.end():]
             assert markup, "blank line after (...)"
-            content = ''.join(self.convert(markup, filename)).lstrip()
+            title_match = find_title(markup, filename)
+            if title_match is None:
+                output.add_id(match.group(1), markup)
+            else:
+                output.title(len(title_match.group(1)), title_match.group(2),
+                             match.group(1))
 
-            regex = re.compile(r'^<(\w+)')      # fuck stackoverflow
-            assert regex.search(content) is not None, "cannot use (...) here"
-            yield regex.sub(r'<\1 id="%s"' % match.group(1), content, count=1)
-
-        @self.add_multiliner(r'^indent:\n')
-        def indent_handler(match, filename):
+        @self._builtin_multiliner(r'^indent:\n')
+        def indent_handler(match, filename, output):
             markup = textwrap.dedent(match.string[match.end():])
             assert markup, "blank line after 'indent:'"
-            yield '<div class="indent">'
-            yield from self.convert(markup, filename)
-            yield '</div>'
+            output.start('div', {'class': 'indent'})
+            output.blocks(markup)
+            output.end('div')
 
         # prevent adding a <p> tag
-        @self.add_multiliner(r'^noparagraph:\n')
-        def no_paragraph_handler(match, filename):
+        @self._builtin_multiliner(r'^noparagraph:\n')
+        def no_paragraph_handler(match, filename, output):
             markup = textwrap.dedent(match.string[match.end():])
             assert markup, "blank line after 'noparagraph:'"
-            yield from self.convert(markup, filename)
+            output.blocks(markup)
 
-        @self.add_multiliner(r'^(gray|red)box:(.*)\n')
-        def box_handler(match, filename):
+        @self._builtin_multiliner(r'^(gray|red)box:(.*)\n')
+        def box_handler(match, filename, output):
             content = textwrap.dedent(match.string[match.end():])
-            yield '<div class="box %sbox">' % match.group(1)
+            output.start('div', {'class': 'box %sbox' % match.group(1)})
             if match.group(2).strip():
-                yield '<h2>'
-                yield from self.convert_chunk(match.group(2), filename)
-                yield '</h2>'
-            yield from self.convert(content, filename)
-            yield '</div>'
-
-        @self.add_multiliner(r'^floatingbox:(.*)\n')
-        def floating_box_handler(match, filename):
+                output.start('h2')
+                output.inline(match.group(2))
+                output.end('h2')
+            output.blocks(content)
+            output.end('div')
+
+        @self._builtin_multiliner(r'^floatingbox:(.*)\n')
+        def floating_box_handler(match, filename, output):
             content = textwrap.dedent(match.string[match.end():])
-            yield '<div class="floatingbox">'
+            output.start('div', {'class': 'floatingbox'})
             if match.group(1).strip():
-                yield '<h2>'
-                yield from self.convert_chunk(match.group(1), filename)
-                yield '</h2>'
-            yield from self.convert(content, filename)
-            yield '</div>'
+                output.start('h2')
+                output.inline(match.group(1))
+                output.end('h2')
+            output.blocks(content)
+            output.end('div')
 
         @self.add_multiliner(r'^image:\s*(\S.*)\n')
         def image_handler(match, filename):
@@ -207,59 +1166,209 @@ class MarkupConverter:
             if False:
                 yield
 
-        @self.add_multiliner(r'^code:(.*)\n')
-        def code_handler(match, filename):
+        @self._builtin_multiliner(r'^code:(.*)\n')
+        def code_handler(match, filename, output):
             code = textwrap.dedent(match.string[match.end():])
-            yield tags.multiline_code(code, match.group(1).strip() or 'text',
-                                      self.pygments_style)
+            output.code(code, match.group(1).strip() or 'text')
 
-        @self.add_multiliner(r'^\* ')
-        def list_handler(match, filename):
-            yield '<ul>'
+        @self._builtin_multiliner(r'^\* ')
+        def list_handler(match, filename, output):
+            output.start('ul')
             for item in re.split(r'\n\* ', match.string[match.end():]):
-                yield '<li>'
-                yield from self.convert_chunk(item, filename)
-                yield '</li>'
-            yield '</ul>'
-
-        @self.add_multiliner(r'^1\. ')
-        def numbered_list_handler(match, filename):
-            yield '<ol>'
+                output.start('li')
+                output.inline(item)
+                output.end('li')
+            output.end('ul')
+
+        @self._builtin_multiliner(r'^1\. ')
+        def numbered_list_handler(match, filename, output):
+            output.start('ol')
             for item in re.split(r'\n\d\. ', match.string[match.end():]):
-                yield '<li>'
-                yield from self.convert_chunk(item, filename)
-                yield '</li>'
-            yield '</ol>'
-
-        @self.add_inliner(r'\B\*\*(.+?)\*\*\B')
-        def bold_handler(match, filename):
-            content = ''.join(self.convert_chunk(match.group(1), filename))
-            return tags.bold(content)
-
-        @self.add_inliner(r'\B\*([^\*].*?)\*\B')
-        def italic_handler(match, filename):
-            content = ''.join(self.convert_chunk(match.group(1), filename))
-            return tags.italic(content)
-
-        @self.add_inliner(r'\b_(.+?)_\b')
-        def underline_handler(match, filename):
-            content = ''.join(self.convert_chunk(match.group(1), filename))
-            return tags.underline(content)
+                output.start('li')
+                output.inline(item)
+                output.end('li')
+            output.end('ol')
+
+        @self._builtin_inliner(r'\B\*\*(.+?)\*\*\B')
+        def bold_handler(match, filename, output):
+            output.start('b')
+            output.inline(match.group(1))
+            output.end('b')
+
+        @self._builtin_inliner(r'\B\*([^\*].*?)\*\B')
+        def italic_handler(match, filename, output):
+            output.start('i')
+            output.inline(match.group(1))
+            output.end('i')
+
+        @self._builtin_inliner(r'\b_(.+?)_\b')
+        def underline_handler(match, filename, output):
+            output.start('u')
+            output.inline(match.group(1))
+            output.end('u')
 
         @self.add_inliner(r'``(.+?)``')
         def inline_code_handler(match, filename):
             return tags.inline_code(match.group(1))
 
-        @self.add_inliner(r'\[([\S\s]+?)\]\((.+?)\)')
-        def link_handler(match, filename):
-            content = ''.join(self.convert_chunk(match.group(1), filename))
-            return tags.link(content, match.group(2))
+        @self._builtin_inliner(r'\[([\S\s]+?)\]\((.+?)\)')
+        def link_handler(match, filename, output):
+            output.start('a', {'href': match.group(2)})
+            output.inline(match.group(1))
+            output.end('a')
 
         @self.add_inliner(r'\s--\s')
         def en_dash(match, filename):
             return ' \N{EN DASH} '
 
 
+# set in each worker process, see FrozenConverter.convert_many()
+_worker_converter = None
+
+
+def _init_worker(converter):
+    global _worker_converter
+    _worker_converter = converter
+
+
+def _convert_in_worker(args):
+    string, filename = args
+    return ''.join(_worker_converter.convert(string, filename))
+
+
+class FrozenConverter(MarkupConverter):
+    """A read-only copy of a :class:`MarkupConverter`.
+
+    Create these with :meth:`MarkupConverter.freeze`. Frozen converters
+    can't be changed and they don't record ids or links, so one frozen
+    converter can be used in many threads and asyncio tasks at the same
+    time. The built-in handlers of the frozen converter use the frozen
+    converter, but custom handlers are the same functions as in the
+    original converter.
+
+    >>> frozen = MarkupConverter().freeze()
+    >>> frozen.convert_many(['**Hello**', '*World*'], jobs=2)
+    ['<p><b>Hello</b></p>\\n\\n', '<p><i>World</i></p>\\n\\n']
+    >>> import asyncio
+    >>> asyncio.run(frozen.convert_async('**Hello**'))
+    '<p><b>Hello</b></p>\\n\\n'
+    >>> frozen.pygments_style = 'monokai'
+    Traceback (most recent call last):
+      ...
+    AttributeError: frozen converters cannot be changed
+    """
+
+    def __init__(self, converter):
+        # this creates new built-in handlers that use self
+        super().__init__()
+        self.pygments_style = converter.pygments_style
+        self.pygments_classes = converter.pygments_classes
+        self.highlight_cache_dir = converter.highlight_cache_dir
+        self.match_budget = converter.match_budget
+
+        for handlers, converter_handlers in [
+                (self._inliners, converter._inliners),
+                (self._multiliners, converter._multiliners)]:
+            for regex, handler in converter_handlers.items():
+                # ignore wrappers added by enable_profiling()
+                handler = getattr(handler, '__wrapped__', handler)
+                if handler not in converter._builtin_handlers:
+                    # may replace a built-in handler
+                    for old_regex in list(handlers):
+                        if ((old_regex.pattern, old_regex.flags) ==
+                                (regex.pattern, regex.flags)):
+                            del handlers[old_regex]
+                    handlers[regex] = handler
+
+        self._inliner_regexes = tuple(self._inliners)
+        self._update_multiliner_index()
+        self._inliners = types.MappingProxyType(self._inliners)
+        self._multiliners = types.MappingProxyType(self._multiliners)
+        self._output_handlers = types.MappingProxyType(self._output_handlers)
+        self._frozen = True
+
+    def _check_not_frozen(self):
+        # __init__ changes things before this is set
+        if getattr(self, '_frozen', False):
+            raise AttributeError("frozen converters cannot be changed")
+
+    def __setattr__(self, name, value):
+        self._check_not_frozen()
+        super().__setattr__(name, value)
+
+    def add_inliner(self, regex):
+        self._check_not_frozen()
+        return super().add_inliner(regex)
+
+    def add_multiliner(self, regex):
+        self._check_not_frozen()
+        return super().add_multiliner(regex)
+
+    def enable_profiling(self):
+        self._check_not_frozen()
+        return super().enable_profiling()
+
+    def freeze(self):
+        return self
+
+    def convert_many(self, strings, filename='<string>', *, jobs=1,
+                     processes=False, executor=None):
+        """Convert a list of strings to a list of HTML strings.
+
+        With ``jobs > 1``, that many threads are used by default. Most
+        of the converting is Python code that can't run in many threads
+        at once, so use ``processes=True`` for big batches. The
+        processes are forked, so custom handlers work in them, but on
+        platforms without ``fork`` (e.g. Windows) threads are used
+        anyway.
+
+        New threads or processes are created on each call. To reuse
+        them, or to avoid forking a program that runs many threads, pass
+        e.g. a :class:`concurrent.futures.ThreadPoolExecutor` as
+        *executor*. Then *jobs* and *processes* are ignored.
+        """
+        if executor is not None:
+            return list(executor.map(
+                lambda string: ''.join(self.convert(string, filename)),
+                strings))
+        if jobs == 1:
+            return [''.join(self.convert(string, filename))
+                    for string in strings]
+
+        # these are slow to import, see benchmarks/run.py
+        import concurrent.futures
+        import multiprocessing
+
+        if processes and 'fork' in multiprocessing.get_all_start_methods():
+            # the forked processes get the converter without pickling it,
+            # and other threads can call this at the same time
+            context = multiprocessing.get_context('fork')
+            with context.Pool(jobs, initializer=_init_worker,
+                              initargs=(self,)) as pool:
+                return pool.map(_convert_in_worker,
+                                [(string, filename) for string in strings])
+
+        with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+            return list(executor.map(
+                lambda string: ''.join(self.convert(string, filename)),
+                strings))
+
+    async def convert_async(self, string, filename='<string>',
+                            executor=None):
+        """Like :meth:`convert`, but for asyncio code.
+
+        This converts in a thread of *executor*, or in the event loop's
+        default executor if *executor* is None, so that the event loop
+        can run other things while e.g. Pygments is highlighting code.
+        The result is a string.
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, lambda: ''.join(self.convert(string, filename)))
+
+
 if __name__ == '__main__':
     import doctest
     print(doctest.testmod())
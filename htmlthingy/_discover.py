@@ -0,0 +1,112 @@
+import fnmatch
+import os
+import posixpath
+
+# http://preservationtutorial.library.cornell.edu/presentation/table7-1.html
+IMAGE_EXTENSIONS = ['tif', 'tiff', 'gif', 'jpeg', 'jpg', 'jif', 'jfif',
+                    'jp2', 'jpx', 'j2k', 'j2c', 'fpx', 'pcd', 'png']
+_IMAGE_SUFFIXES = {'.' + ext for ext in IMAGE_EXTENSIONS}
+
+
+def _matches(path, patterns):
+    return any(fnmatch.fnmatchcase(path, pattern) for pattern in patterns)
+
+
+class Scanner:
+    """Finds input files with one walk over the directory tree.
+
+    Without *recursive*, this finds the same files as older htmlthingy
+    versions: ``*.txt``, ``*.css`` and ``*.js`` files in the current
+    directory, and images in the ``images`` directory. With *recursive*,
+    those are found from all subdirectories.
+
+    Paths are matched against *include* and *exclude* with
+    :mod:`fnmatch`, with ``/`` as the separator. If *include* is given,
+    only files that match one of its patterns are used. Excluded
+    directories are not scanned at all.
+
+    The contents of directories are cached, and a directory is listed
+    again only if its modification time changes, so calling
+    :meth:`scan` again is cheap.
+    """
+
+    def __init__(self, root='.', *, recursive=False, include=None,
+                 exclude=()):
+        self.root = root
+        self.recursive = recursive
+        self.include = include
+        self.exclude = list(exclude)
+        self._cache = {}    # {relative_dir: (mtime_ns, [(name, is_dir)])}
+
+    def _list_dir(self, relative_dir, new_cache):
+        path = os.path.join(self.root, relative_dir)
+        mtime = os.stat(path).st_mtime_ns
+        try:
+            cached_mtime, entries = self._cache[relative_dir]
+        except KeyError:
+            cached_mtime = None
+
+        if cached_mtime != mtime:
+            with os.scandir(path) as scandir:
+                entries = sorted((entry.name, entry.is_dir())
+                                 for entry in scandir)
+        new_cache[relative_dir] = (mtime, entries)
+        return entries
+
+    def _classify(self, path):
+        # returns 'page', 'asset' or None
+        dirname, basename = posixpath.split(path)
+        suffix = posixpath.splitext(basename)[1]
+        if not self.recursive:
+            if dirname == 'images':
+                return 'asset' if suffix in _IMAGE_SUFFIXES else None
+            if dirname:
+                return None
+
+        if suffix == '.txt':
+            return 'page'
+        if suffix in {'.css', '.js'}:
+            return 'asset'
+        if suffix in _IMAGE_SUFFIXES and (self.recursive or dirname):
+            return 'asset'
+        return None
+
+    def scan(self, skip_dirs=()):
+        """Return a two-tuple of ``(pages, assets)`` lists of paths.
+
+        The paths are relative to the root and sorted, and *skip_dirs*
+        are excluded like the *exclude* patterns.
+        """
+        exclude = self.exclude + [path.replace(os.sep, '/').rstrip('/')
+                                  for path in skip_dirs]
+        pages = []
+        assets = []
+        new_cache = {}
+        stack = ['']
+        while stack:
+            relative_dir = stack.pop()
+            for name, is_dir in self._list_dir(relative_dir, new_cache):
+                # glob ignores these too
+                if name.startswith('.'):
+                    continue
+                path = posixpath.join(relative_dir, name)
+                if _matches(path, exclude):
+                    continue
+
+                if is_dir:
+                    if self.recursive or path == 'images':
+                        stack.append(path)
+                    continue
+                if self.include is not None and not _matches(
+                        path, self.include):
+                    continue
+
+                kind = self._classify(path)
+                if kind == 'page':
+                    pages.append(path.replace('/', os.sep))
+                elif kind == 'asset':
+                    assets.append(path.replace('/', os.sep))
+
+        # forget about directories that were deleted
+        self._cache = new_cache
+        return (sorted(pages), sorted(assets))
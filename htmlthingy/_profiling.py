@@ -0,0 +1,161 @@
+import functools
+import json
+import time
+
+
+class Profiler:
+    """Collects timing information from a :class:`.MarkupConverter`.
+
+    Use :meth:`.MarkupConverter.enable_profiling` to create one. Times
+    are "self times": the time spent in a handler doesn't include the
+    time spent in the :meth:`~.MarkupConverter.convert` or
+    :meth:`~.MarkupConverter.convert_chunk` calls made by that handler,
+    and regex matching time doesn't include the handlers that were
+    called.
+    """
+
+    def __init__(self):
+        # {handler_name: {'calls': int, 'seconds': float, 'bytes': int}}
+        self.handlers = {}
+        self.matching_seconds = 0.0
+        # total time of conversions that weren't called from handlers
+        self.converting_seconds = 0.0
+        # {filename: {'convert_seconds': float, 'write_seconds': float}}
+        self.files = {}
+        self._stack = []    # time spent in children of each running frame
+
+    def _enter(self):
+        self._stack.append(0.0)
+        return time.perf_counter()
+
+    def _exit(self, start):
+        # returns self time
+        elapsed = time.perf_counter() - start
+        children = self._stack.pop()
+        if self._stack:
+            self._stack[-1] += elapsed
+        else:
+            self.converting_seconds += elapsed
+        return elapsed - children
+
+    def _add_handler_call(self, name, seconds, nbytes):
+        stats = self.handlers.setdefault(
+            name, {'calls': 0, 'seconds': 0.0, 'bytes': 0})
+        stats['calls'] += 1
+        stats['seconds'] += seconds
+        stats['bytes'] += nbytes
+
+    def wrap_inliner(self, function):
+        name = getattr(function, '__name__', repr(function))
+
+        @functools.wraps(function)
+        def wrapper(match, filename):
+            start = self._enter()
+            try:
+                result = function(match, filename)
+            finally:
+                seconds = self._exit(start)
+            self._add_handler_call(name, seconds, len(result))
+            return result
+
+        return wrapper
+
+    def _wrap_generator(self, function, on_step):
+        # a generator does its work when it's iterated over, so each step
+        # is timed separately
+        @functools.wraps(function)
+        def wrapper(*args):
+            iterator = iter(function(*args))
+            while True:
+                start = self._enter()
+                try:
+                    piece = next(iterator)
+                except StopIteration:
+                    on_step(self._exit(start), None)
+                    return
+                except BaseException:
+                    self._exit(start)
+                    raise
+                on_step(self._exit(start), piece)
+                yield piece
+
+        return wrapper
+
+    def wrap_multiliner(self, function):
+        name = getattr(function, '__name__', repr(function))
+        stats = {'calls': 0, 'seconds': 0.0, 'bytes': 0}
+
+        def on_step(seconds, piece):
+            stats['seconds'] += seconds
+            if piece is not None:
+                stats['bytes'] += len(piece)
+            else:
+                self._add_handler_call(name, stats['seconds'], stats['bytes'])
+                stats['seconds'] = 0.0
+                stats['bytes'] = 0
+
+        return self._wrap_generator(function, on_step)
+
+    def wrap_converting_method(self, method):
+        def on_step(seconds, piece):
+            self.matching_seconds += seconds
+
+        return self._wrap_generator(method, on_step)
+
+    def take_stats(self):
+        """Return everything collected so far as a dict and start over."""
+        result = {
+            'handlers': self.handlers,
+            'matching_seconds': self.matching_seconds,
+            'converting_seconds': self.converting_seconds,
+            'files': self.files,
+        }
+        self.handlers = {}
+        self.matching_seconds = 0.0
+        self.converting_seconds = 0.0
+        self.files = {}
+        return result
+
+    def add_stats(self, stats):
+        """Add stats returned by :meth:`take_stats` of another profiler."""
+        for name, handler_stats in stats['handlers'].items():
+            mine = self.handlers.setdefault(
+                name, {'calls': 0, 'seconds': 0.0, 'bytes': 0})
+            for key, value in handler_stats.items():
+                mine[key] += value
+        self.matching_seconds += stats['matching_seconds']
+        self.converting_seconds += stats['converting_seconds']
+        self.files.update(stats['files'])
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({
+                'handlers': self.handlers,
+                'matching_seconds': self.matching_seconds,
+                'handler_seconds': sum(
+                    stats['seconds'] for stats in self.handlers.values()),
+                'files': self.files,
+            }, file, indent=2, sort_keys=True)
+
+    def print_summary(self, count=10):
+        handler_seconds = sum(stats['seconds']
+                              for stats in self.handlers.values())
+        print("Regex matching: %.3fs, handlers: %.3fs"
+              % (self.matching_seconds, handler_seconds))
+
+        print("Slowest handlers:")
+        slowest = sorted(self.handlers.items(),
+                         key=(lambda item: item[1]['seconds']), reverse=True)
+        for name, stats in slowest[:count]:
+            print("  %8.3fs %8d calls %10d bytes  %s" % (
+                stats['seconds'], stats['calls'], stats['bytes'], name))
+
+        if self.files:
+            print("Slowest files:")
+            slowest = sorted(
+                self.files.items(), reverse=True,
+                key=(lambda item: sum(item[1].values())))
+            for filename, stats in slowest[:count]:
+                print("  %8.3fs converting %8.3fs writing  %s" % (
+                    stats['convert_seconds'], stats['write_seconds'],
+                    filename))
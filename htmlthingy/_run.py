@@ -1,29 +1,190 @@
 import functools
-import glob
+import hashlib
+import inspect
+import json
+import multiprocessing
 import os
+import pickle
 import posixpath
-import shutil
 import string
-
-import tqdm
+import tempfile
+import threading
+import time
 
 import htmlthingy
+from htmlthingy import _compress, _discover, _search, _sync, _tree, outputs
+
+# this is written to the output directory, and incremental builds use it
+# for finding out what has changed since the previous build
+_MANIFEST_NAME = '.htmlthingy-manifest.json'
+_MANIFEST_VERSION = 4
+
+# input files bigger than this are converted while reading them, instead
+# of reading the whole file into memory first
+_STREAMING_INPUT_SIZE = 4 * 1024 * 1024
+
+
+_PAGE_TEMPLATE = '''\
+<!DOCTYPE html>
+<html>
+<head>
+<meta charset="UTF-8">
+{stylesheets}<title>{title}</title>
+{head_extras}</head>
+<body>
+<div id="content">
+{sidebar}{content}</div>
+</body>
+</html>
+'''
+
+
+@functools.lru_cache()
+def _split_template(template):
+    # the content is yielded in pieces by the converter, so it can't be
+    # passed to str.format()
+    before, content, after = template.partition('{content}')
+    assert content, "the template doesn't contain {content}"
+    return (before, after)
+
+
+@functools.lru_cache()
+def _accepts_content(function):
+    try:
+        return 'content' in inspect.signature(function).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+class _RecordingOutput:
+    # worker processes can't write to e.g. an archive opened in the main
+    # process, so they send the files there instead
+
+    def __init__(self, output):
+        self.output = output
+        self.files = []     # [(path, bytes)]
+
+    def __getattr__(self, name):
+        return getattr(self.output, name)
+
+    def write(self, path, pieces, encoding='utf-8'):
+        if encoding is None:
+            data = b''.join(pieces)
+        else:
+            data = ''.join(pieces).encode(encoding)
+        self.files.append((path, data))
+
+
+# set in each worker process, see Builder._build_pages()
+_worker_builder = None
+
+
+def _init_worker(builder):
+    # the worker is forked, so builder is a copy that can be changed here
+    global _worker_builder
+    _worker_builder = builder
+    if not isinstance(builder._output, outputs.DirectoryOutput):
+        builder._output = _RecordingOutput(builder._output)
+
+
+def _build_page_in_worker(args):
+    entry = _worker_builder._build_page(*args)
+    if isinstance(_worker_builder._output, _RecordingOutput):
+        files = _worker_builder._output.files
+        _worker_builder._output.files = []
+    else:
+        files = []
+
+    profiler = _worker_builder.converter.profiler
+    return (entry, None if profiler is None else profiler.take_stats(), files)
+
+
+def _dependency_hash(path):
+    """Return the sha1 of a file as a string, or None if it doesn't exist.
+
+    >>> import os, tempfile
+    >>> fd, path = tempfile.mkstemp()
+    >>> os.close(fd)
+    >>> _dependency_hash(path)
+    'da39a3ee5e6b4b0d3255bfef95601890afd80709'
+    >>> os.remove(path)
+    >>> print(_dependency_hash(path))
+    None
+    """
+    record = _sync.file_record(path)
+    return None if record is None else record[2]
+
+
+class _Snapshot:
 
-# http://preservationtutorial.library.cornell.edu/presentation/table7-1.html
-_IMAGE_EXTENSIONS = ['tif', 'tiff', 'gif', 'jpeg', 'jpg', 'jif', 'jfif',
-                     'jp2', 'jpx', 'j2k', 'j2c', 'fpx', 'pcd', 'png']
+    def __init__(self, paths):
+        self._stats = {}
+        self.update(paths)
+
+    def update(self, paths):
+        """Return lists of changed and removed paths since last time."""
+        new_stats = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            new_stats[path] = (stat.st_mtime_ns, stat.st_size)
+
+        changed = [path for path, stat in new_stats.items()
+                   if self._stats.get(path) != stat]
+        removed = [path for path in self._stats if path not in new_stats]
+        self._stats = new_stats
+        return (changed, removed)
 
 
 class Builder:
+    """Converts ``.txt`` files to a directory of HTML files.
+
+    The input files are found when the builder is created, and they are
+    in the :attr:`infiles` and :attr:`additional_files` lists. Only
+    ``*.txt``, ``*.css`` and ``*.js`` in the current directory and
+    images in ``images`` are found by default. With ``recursive=True``
+    they are found from subdirectories as well. *include* and *exclude*
+    are lists of :mod:`fnmatch` patterns like ``'drafts/*'``, see
+    :class:`htmlthingy._discover.Scanner`.
+
+    The files are written to the :attr:`outputdir` directory, unless
+    *output* is e.g. a :class:`htmlthingy.outputs.ZipOutput`. See the
+    README for the other keyword arguments.
+    """
 
-    def __init__(self, title=None):
+    def __init__(self, title=None, *, incremental=False, jobs=1,
+                 profile=None, copy_method='copy', recursive=False,
+                 include=None, exclude=(), tree_cache=None, minify=False,
+                 precompress=False, output=None, search_index=False):
         self.converter = htmlthingy.MarkupConverter()
-        self.infiles = sorted(glob.glob('*.txt'))
+        self.incremental = incremental
+        self.jobs = jobs
+        self.profile = profile
+        self.copy_method = copy_method
+        self.tree_cache = tree_cache
+        self.minify = minify
+        self.precompress = precompress
+        self.output = output
+        self.search_index = search_index
+        self._output = None     # what run() writes to, may be wrapped
+        self._parse_fingerprint = None
+        # watch() and the server started by serve() use the converter
+        # from different threads
+        self._lock = threading.Lock()
+        self._link_index = None
+        self._dependencies = set()      # files read by pages, for watch()
+        self._stylesheet_links = {}     # {(dirname, stylesheets): html}
+        self._stylesheets = ()
+        # {stylesheets}, {title}, {head_extras}, {sidebar} and {content}
+        # are replaced with stuff, other { and } characters must be doubled
+        self.page_template = _PAGE_TEMPLATE
         self.outputdir = 'html'
-        self.additional_files = glob.glob('*.css') + glob.glob('*.js')
-        if os.path.isdir('images'):
-            for ext in _IMAGE_EXTENSIONS:
-                self.additional_files.extend(glob.glob('images/*.%s' % ext))
+        self._scanner = _discover.Scanner(
+            recursive=recursive, include=include, exclude=exclude)
+        self.infiles, self.additional_files = self._scanner.scan(
+            skip_dirs=[self.outputdir])
 
     def infile2outfile(self, txtfile):
         """Return a HTML file path based on a text file path."""
@@ -32,71 +193,631 @@ class Builder:
         basename_ish = os.path.splitext(txtfile)[0] + '.html'  # may contain /
         return os.path.join(self.outputdir, basename_ish)
 
+    def _outfile(self, txtfile):
+        # the HTML file path relative to the output
+        return os.path.relpath(self.infile2outfile(txtfile), self.outputdir)
+
+    def _get_output(self):
+        if self.output is None:
+            return outputs.DirectoryOutput(self.outputdir)
+        return self.output
+
+    def _read_manifest(self):
+        if not self._output.persistent:
+            return None
+        try:
+            manifest = json.loads(
+                self._output.read(_MANIFEST_NAME).decode('utf-8'))
+        except (OSError, ValueError):
+            return None
+        if manifest.get('version') != _MANIFEST_VERSION:
+            return None
+        return manifest
+
+    def _write_manifest(self, manifest):
+        if self._output.persistent:
+            self._output.write(_MANIFEST_NAME, [
+                json.dumps(manifest, indent=1, sort_keys=True)])
+
+    def _get_fingerprint(self):
+        # old pages can't be reused if anything in here changes
+        hasher = hashlib.sha1()
+        hasher.update(repr((
+            htmlthingy.__version__,
+            self.outputdir,
+            self.converter._fingerprint(),
+            self._get_stylesheets(),
+            self.page_template,
+            self.minify,
+        )).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def _get_stylesheets(self):
+        # style.css is last so that it can override pygments.css
+        result = []
+        if self.converter.pygments_classes:
+            result.append('pygments.css')
+        if 'style.css' in self.additional_files:
+            result.append('style.css')
+        return result
+
+    def _get_stylesheet_links(self, htmlfile, stylesheets):
+        # all pages in the same directory have the same links
+        key = (os.path.dirname(htmlfile), stylesheets)
+        try:
+            return self._stylesheet_links[key]
+        except KeyError:
+            pass
+
+        result = ''
+        for stylesheet in stylesheets:
+            copied_path = os.path.join(self.outputdir, stylesheet)
+            relative = os.path.relpath(copied_path, os.path.dirname(htmlfile))
+            result += ('<link rel="stylesheet" href="%s">\n'
+                       % relative.replace(os.sep, '/'))
+        self._stylesheet_links[key] = result
+        return result
+
+    def _iter_page(self, txtfile, markup, stylesheets,
+                   title, head_extras, sidebar, *, search_parser=None):
+        # yields pieces of the page's HTML, markup can be a string, a file
+        # object or a tree from the converter's parse() method, and the
+        # content is also fed to search_parser if it's given
+        before, after = _split_template(self.page_template)
+        htmlfile = self.infile2outfile(txtfile)
+        yield before.format(
+            stylesheets=self._get_stylesheet_links(htmlfile, stylesheets),
+            title=title,
+            head_extras=head_extras,
+            sidebar=('' if sidebar is None else
+                     '<div id="sidebar">%s</div>\n' % sidebar))
+
+        if isinstance(markup, str) and self.converter.profiler is None:
+            # faster than convert(), and the markup is in memory anyway
+            content = []
+            self.converter.convert_into(markup, content.append, txtfile)
+        elif isinstance(markup, str):
+            # the profiler measures convert()
+            content = self.converter.convert(markup, txtfile)
+        elif isinstance(markup, _tree.Node):
+            content = self.converter.render(markup, txtfile)
+        else:
+            content = self.converter.convert_stream(markup, txtfile)
+
+        if search_parser is not None:
+            content = search_parser.feed_through(content)
+        yield from content
+        yield after
+
+    def _write_page(self, txtfile, markup, *hooks, search_parser=None):
+        pieces = self._iter_page(txtfile, markup, *hooks,
+                                 search_parser=search_parser)
+        if self.minify:
+            pieces = _compress.minify(pieces)
+        self._output.write(self._outfile(txtfile), pieces)
+
+    def _update_compressed(self, manifest):
+        # compressed files are generated, but they are listed in the
+        # manifest so that they get deleted if precompress is turned off
+        if isinstance(self._output, outputs.DirectoryOutput):
+            compressed = _compress.precompress(self._output.path)
+        else:
+            compressed = self._output.finish()
+        manifest['generated'] = [
+            path for path in manifest['generated']
+            if not path.endswith(_compress.EXTENSIONS)
+        ] + compressed
+
+    def _sync_files(self, sources, old_records):
+        if isinstance(self._output, outputs.DirectoryOutput):
+            return _sync.sync(sources, self._output.path, old_records,
+                              self.copy_method)
+        return _sync.sync_output(sources, self._output, old_records)
+
+    def _call_hooks(self, txtfile, content):
+        # content is None for huge files that aren't read all at once
+        result = []
+        for hook in [self.get_title, self.get_head_extras,
+                     self.get_sidebar_content]:
+            if (content is not None and
+                    _accepts_content(getattr(hook, '__func__', hook))):
+                result.append(hook(txtfile, content=content))
+            else:
+                result.append(hook(txtfile))
+        return tuple(result)
+
+    def _read_input(self, txtfile):
+        # returns (sha1, content), and content is None for huge files
+        if os.path.getsize(txtfile) > _STREAMING_INPUT_SIZE:
+            return (_sync.hash_file(txtfile), None)
+
+        with open(txtfile, 'rb') as file:
+            raw_content = file.read()
+        # universal newlines, like open(txtfile, 'r') would do
+        content = raw_content.decode('utf-8')
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+        return (hashlib.sha1(raw_content).hexdigest(), content)
+
+    def _load_tree(self, txtfile, file_hash, content):
+        # parsed trees are cached by the input file's content, so
+        # changing e.g. the page template or pygments style doesn't
+        # parse everything again
+        key = hashlib.sha1(repr((
+            htmlthingy.__version__, txtfile, file_hash,
+            self._parse_fingerprint)).encode('utf-8')).hexdigest()
+        path = os.path.join(self.tree_cache, key + '.pickle')
+
+        # custom handlers run when parsing, so the ids, links and
+        # dependencies that they record are saved with the tree
+        ids, links, dependencies = self.converter.link_records.pop(
+            txtfile, ([], [], []))
+        try:
+            with open(path, 'rb') as file:
+                tree, records, dependency_hashes = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            tree = None
+        else:
+            if any(_dependency_hash(dependency) != sha
+                   for dependency, sha in dependency_hashes.items()):
+                tree = None
+
+        if tree is None:
+            tree = self.converter.parse(content, txtfile)
+            records = self.converter.link_records.pop(txtfile, ([], [], []))
+            dependency_hashes = {
+                dependency: _dependency_hash(dependency)
+                for dependency in records[2]}
+            os.makedirs(self.tree_cache, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.tree_cache,
+                                             suffix='.tmp')
+            try:
+                with open(fd, 'wb') as file:
+                    pickle.dump((tree, records, dependency_hashes), file,
+                                pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+
+        self.converter.link_records[txtfile] = (
+            ids + records[0], links + records[1], dependencies + records[2])
+        return tree
+
+    def render_page(self, txtfile):
+        """Return the HTML of a page as a string without writing anything.
+
+        The page is converted from the current content of *txtfile*,
+        even if the HTML file is outdated or doesn't exist.
+        """
+        file_hash, content = self._read_input(txtfile)
+        hooks = self._call_hooks(txtfile, content)
+        stylesheets = tuple(self._get_stylesheets())
+        if content is not None:
+            return ''.join(self._iter_page(txtfile, content, stylesheets,
+                                           *hooks))
+        with open(txtfile, 'r', encoding='utf-8') as markup_file:
+            return ''.join(self._iter_page(txtfile, markup_file, stylesheets,
+                                           *hooks))
+
+    def _build_page(self, txtfile, old_entry):
+        # returns a manifest entry with a hash of everything that the page
+        # depends on, and the ids and links that the page contains
+        file_hash, content = self._read_input(txtfile)
+        hooks = self._call_hooks(txtfile, content)
+        page_hash = hashlib.sha1(
+            (file_hash + repr(hooks)).encode('utf-8')).hexdigest()
+        if (old_entry is not None and old_entry['hash'] == page_hash and
+                ('search' in old_entry) == bool(self.search_index) and
+                self._output.exists(self._outfile(txtfile))):
+            # the hooks may have recorded dependencies
+            self.converter.link_records.pop(txtfile, None)
+            return old_entry
+
+        profiler = self.converter.profiler
+        if profiler is not None:
+            start = time.perf_counter()
+            converting_before = profiler.converting_seconds
+
+        title, head_extras, sidebar = hooks
+        if self.search_index:
+            search_parser = _search.SectionParser(' '.join(title.split()))
+        else:
+            search_parser = None
+
+        if content is None:
+            # the input file is read lazily because it's huge
+            with open(txtfile, 'r', encoding='utf-8') as markup_file:
+                self._write_page(txtfile, markup_file, self._stylesheets,
+                                 *hooks, search_parser=search_parser)
+        elif self.tree_cache is not None:
+            tree = self._load_tree(txtfile, file_hash, content)
+            self._write_page(txtfile, tree, self._stylesheets, *hooks,
+                             search_parser=search_parser)
+        else:
+            self._write_page(txtfile, content, self._stylesheets, *hooks,
+                             search_parser=search_parser)
+
+        if profiler is not None:
+            convert_seconds = profiler.converting_seconds - converting_before
+            profiler.files[txtfile] = {
+                'convert_seconds': convert_seconds,
+                'write_seconds': (time.perf_counter() - start -
+                                  convert_seconds),
+            }
+
+        # linkcheck imports htmlthingy.progressbar, can't import it earlier
+        from htmlthingy import linkcheck
+
+        ids, links = linkcheck.find_ids_and_links(head_extras + (sidebar or ''))
+        content_ids, content_links, dependencies = (
+            self.converter.link_records.pop(txtfile, ([], [], [])))
+        entry = {'hash': page_hash,
+                 'ids': ids + content_ids,
+                 'links': links + content_links,
+                 'depends': sorted(set(dependencies))}
+        if search_parser is not None:
+            entry['search'] = {'title': search_parser.page_title,
+                               'sections': search_parser.get_sections()}
+        return entry
+
+    def _build_pages(self, old_entries):
+        # yields (txtfile, manifest_entry) pairs in the same order as infiles
+        jobs = self.jobs or os.cpu_count() or 1
+        if jobs > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            print("Cannot fork worker processes on this platform, "
+                  "building with one process...")
+            jobs = 1
+
+        pbar = htmlthingy.progressbar(self.infiles, "Processing files")
+        if jobs == 1:
+            for txtfile in pbar:
+                yield (txtfile, self._build_page(txtfile,
+                                                 old_entries.get(txtfile)))
+            return
+
+        # the forked processes get the builder and its converter without
+        # pickling them, including any callbacks defined in build.py
+        context = multiprocessing.get_context('fork')
+        with context.Pool(jobs, initializer=_init_worker,
+                          initargs=(self,)) as pool:
+            results = pool.imap(
+                _build_page_in_worker,
+                [(txtfile, old_entries.get(txtfile))
+                 for txtfile in self.infiles])
+            # zip() moves the progress bar to a file before waiting for
+            # the result
+            for txtfile, (entry, stats, files) in zip(pbar, results):
+                if stats is not None:
+                    self.converter.profiler.add_stats(stats)
+                for path, data in files:
+                    self._output.write(path, [data], encoding=None)
+                yield (txtfile, entry)
+
+    def _update(self, txtfiles, sources, changed_paths):
+        # rebuild some pages and copy some files after a run(), returns
+        # other pages that were rebuilt because they depend on changed_paths
+        manifest = self._read_manifest()
+        assert manifest is not None, "call run() first"
+        old_link_index = self._get_link_index(manifest)
+        for txtfile in manifest['pages'].keys() - set(self.infiles):
+            del manifest['pages'][txtfile]
+
+        dependents = [
+            txtfile for txtfile, entry in manifest['pages'].items()
+            if txtfile not in txtfiles and
+            not set(changed_paths).isdisjoint(entry['depends'])]
+        self.converter.link_records = {}
+        try:
+            for txtfile in txtfiles + dependents:
+                manifest['pages'][txtfile] = self._build_page(txtfile, None)
+        finally:
+            self.converter.link_records = None
+        manifest['dependencies'] = self._get_dependency_records(
+            manifest['pages'], manifest['dependencies'])
+        if self.search_index:
+            self._write_search_index(manifest, manifest.get('search'))
+
+        manifest['files'].update(self._sync_files(sources, {}))
+        if self.precompress:
+            self._update_compressed(manifest)
+        self._write_manifest(manifest)
+
+        self._link_index = self._get_link_index(manifest)
+        self._warn_about_broken_links(old_link_index, self._link_index)
+        self._dependencies = set(manifest['dependencies'])
+        self._output.close()
+        return dependents
+
+    def _write_search_index(self, manifest, old_search):
+        # writes only the files that changed, and removes files that are
+        # no longer needed
+        if old_search is None:
+            old_search = {'docs': [], 'files': {}}
+        pages = {self._outfile(txtfile).replace(os.sep, '/'): entry['search']
+                 for txtfile, entry in manifest['pages'].items()}
+        docs, shards = _search.update_index(pages, old_search['docs'])
+
+        contents = {'search/docs.json': docs}
+        contents.update(('search/%s.json' % name, shard)
+                        for name, shard in shards.items())
+        hashes = {}
+        for path, value in contents.items():
+            data = json.dumps(value, ensure_ascii=False, sort_keys=True,
+                              separators=(',', ':'))
+            hashes[path] = hashlib.sha1(data.encode('utf-8')).hexdigest()
+            if (old_search['files'].get(path) != hashes[path] or
+                    not self._output.exists(path)):
+                self._output.write(path, [data])
+
+        for path in old_search['files'].keys() - hashes.keys():
+            self._output.remove(path)
+        manifest['search'] = {'docs': docs, 'files': hashes}
+        manifest['generated'] = [
+            path for path in manifest['generated']
+            if path not in old_search['files']
+        ] + sorted(hashes)
+
+    def _find_changed_dependencies(self, records):
+        # returns (changed_paths, new_records)
+        changed = set()
+        new_records = {}
+        for path, old_record in records.items():
+            record = _sync.file_record(path, old_record)
+            new_records[path] = record
+            if (record is None) != (old_record is None) or (
+                    record is not None and record[2] != old_record[2]):
+                changed.add(path)
+        return (changed, new_records)
+
+    def _get_dependency_records(self, pages, known_records):
+        # known_records avoids hashing files that haven't changed
+        paths = {path for entry in pages.values() for path in entry['depends']}
+        return {path: _sync.file_record(path, known_records.get(path))
+                for path in sorted(paths)}
+
+    def _get_link_index(self, manifest):
+        # {path_relative_to_outputdir: (ids, links)}
+        return {self._outfile(txtfile): (entry['ids'], entry['links'])
+                for txtfile, entry in manifest['pages'].items()}
+
+    def _warn_about_broken_links(self, old_link_index, new_link_index):
+        # this doesn't complain about links that were already broken,
+        # check_links() is for that
+        from htmlthingy import linkcheck
+
+        old_invalid = set(linkcheck.find_invalid_links(old_link_index))
+        for path, target in linkcheck.find_invalid_links(new_link_index):
+            if (path, target) not in old_invalid:
+                linkcheck.print_invalid_link(path, target, self.outputdir)
+
+    def _skip_output_files(self):
+        # the files were found before the user could change outputdir, so
+        # they may contain files from a previous build
+        outputdir = os.path.abspath(self.outputdir)
+        for paths in [self.infiles, self.additional_files]:
+            paths[:] = [
+                path for path in paths
+                if os.path.commonpath([outputdir, os.path.abspath(path)])
+                != outputdir]
+
+    def _find_new_files(self):
+        pages, assets = self._scanner.scan(skip_dirs=[self.outputdir])
+        old_infiles = set(self.infiles)
+        old_additional_files = set(self.additional_files)
+        self.infiles.extend(path for path in pages
+                            if path not in old_infiles)
+        self.additional_files.extend(path for path in assets
+                                     if path not in old_additional_files)
+
+    def watch(self, interval=0.5):
+        """Build the pages and keep them up to date until Ctrl+C is pressed.
+
+        This does an incremental :meth:`run`, and then checks the input
+        files every *interval* seconds. Changed pages and files are
+        built or copied again, and new files are added to
+        :attr:`infiles` and :attr:`additional_files`.
+        """
+        if not self._get_output().persistent:
+            raise ValueError("cannot watch with an output that doesn't "
+                             "keep files between builds")
+        self.incremental = True
+        with self._lock:
+            self.run()
+        watched = _Snapshot(self._get_watched_paths())
+        print("Watching for changes, press Ctrl+C to stop...")
+
+        try:
+            while True:
+                time.sleep(interval)
+                self._find_new_files()
+                changed, removed = watched.update(self._get_watched_paths())
+                if not (changed or removed):
+                    continue
+
+                for path in removed:
+                    if path in self.infiles:
+                        self.infiles.remove(path)
+                        self._output.remove(self._outfile(path))
+                    elif path in self.additional_files:
+                        self.additional_files.remove(path)
+                        self._output.remove(path)
+
+                txtfiles = [path for path in changed if path in self.infiles]
+                sources = [path for path in changed
+                           if path in self.additional_files]
+                with self._lock:
+                    dependents = self._update(txtfiles, sources,
+                                              changed + removed)
+                for path in changed + dependents:
+                    print("Updated %s" % path)
+        except KeyboardInterrupt:
+            pass
+
+    def _get_watched_paths(self):
+        result = self.infiles + [path for path in self.additional_files
+                                 if not os.path.isdir(path)]
+        return result + sorted(self._dependencies - set(result))
+
+    def serve(self, port=8000, host='localhost', interval=0.5):
+        """Serve the output directory over HTTP while running :meth:`watch`.
+
+        Pages are converted when a browser requests them, so they are
+        up to date even if :meth:`watch` hasn't rebuilt them yet.
+        Other files are served from the output, e.g. the output directory.
+        """
+        # _serve imports http.server, no need to do that in every build
+        from htmlthingy import _serve
+
+        server = _serve.create_server(self, host, port)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        print("Serving at http://%s:%d/" % (host, server.server_port))
+        try:
+            self.watch(interval)
+        finally:
+            server.shutdown()
+            server.server_close()
+
     def run(self):
-        # TODO: cache stuff somehow
-        if os.path.exists(self.outputdir):
-            print("Removing '%s' directory..." % self.outputdir)
-            shutil.rmtree(self.outputdir)
-        os.makedirs(self.outputdir)
+        """Build the HTML files.
 
-        for txtfile in htmlthingy.progressbar(self.infiles,
-                                              "Processing files"):
-            htmlfile = self.infile2outfile(txtfile).replace(os.sep, '/')
+        If :attr:`incremental` is true and the output directory contains
+        a previous build, only pages whose input file, title, head
+        extras, sidebar, converter or other files that they read (see
+        :meth:`MarkupConverter.record_dependency`) have changed are
+        rebuilt, and links that were valid in the previous build but
+        aren't anymore are printed. Otherwise everything is built from
+        scratch, and files of the previous build that aren't needed
+        anymore are deleted. Files whose content doesn't change are not
+        written again in either case, so they keep their modification
+        times. If the output doesn't contain a previous build, it's
+        cleared first.
 
-            with open(txtfile, 'r', encoding='utf-8') as file:
-                content = file.read()
-
-            os.makedirs(os.path.dirname(htmlfile), exist_ok=True)
-            with open(htmlfile, 'x', encoding='utf-8') as file:
-                file.write('<!DOCTYPE html>\n')
-                file.write('<html>\n')
-
-                file.write('<head>\n')
-                file.write('<meta charset="UTF-8">\n')
-                if 'style.css' in self.additional_files:
-                    copied_path = os.path.join(self.outputdir, 'style.css')
-                    relative = os.path.relpath(
-                        copied_path,
-                        os.path.dirname(htmlfile))
-                    file.write('<link rel="stylesheet" href="%s">\n'
-                               % relative.replace(os.sep, '/'))
-                file.write('<title>%s</title>\n' % self.get_title(txtfile))
-                file.write(self.get_head_extras(txtfile))
-                file.write('</head>\n')
-
-                file.write('<body>\n')
-
-                file.write('<div id="content">\n')
-                sidebar = self.get_sidebar_content(txtfile)
-                if sidebar is not None:
-                    file.write('<div id="sidebar">%s</div>\n' % sidebar)
-
-                for chunk in self.converter.convert(content, txtfile):
-                    file.write(chunk)
-                file.write('</div>\n')
-
-                file.write('</body>\n')
-                file.write('</html>\n')
-
-        if self.additional_files:
-            for source in htmlthingy.progressbar(
-                    self.additional_files, "Copying additional files"):
-                dest = os.path.join(self.outputdir, source)
-                if os.path.isdir(source):
-                    shutil.copytree(source, dest)
-                else:
-                    os.makedirs(os.path.dirname(dest), exist_ok=True)
-                    shutil.copy(source, dest)
+        If :attr:`profile` is a path, timing information about handlers
+        and files is written there as JSON, and the slowest things are
+        printed.
+
+        If :attr:`tree_cache` is a directory, parsed pages are cached
+        there and rendered with the converter's :meth:`~MarkupConverter.render`
+        method, so a changed stylesheet or template doesn't parse the
+        pages again.
+        """
+        self._skip_output_files()
+        if self.profile is not None:
+            self.converter.enable_profiling()
+        self._stylesheets = tuple(self._get_stylesheets())
+        if self.tree_cache is not None:
+            self._parse_fingerprint = self.converter._parse_fingerprint()
+        self._output = self._get_output()
+        if self.precompress and not isinstance(self._output,
+                                               outputs.DirectoryOutput):
+            self._output = _compress.CompressingOutput(self._output)
+
+        old_manifest = self._read_manifest()
+        if old_manifest is None:
+            self._output.clear()
+            old_manifest = {'fingerprint': None, 'pages': {}, 'files': {},
+                            'generated': [], 'dependencies': {}}
+        elif not self.incremental:
+            # everything is built and copied again, but the old manifest
+            # tells which files to delete, and files that would get the
+            # same content are left untouched
+            old_manifest['fingerprint'] = None
+            old_manifest['files'] = dict.fromkeys(old_manifest['files'])
+
+        new_manifest = {
+            'version': _MANIFEST_VERSION,
+            'fingerprint': self._get_fingerprint(),
+            'pages': {},
+            'files': {},        # {path: [size, mtime_ns, sha1]}
+            'generated': [],    # files created by htmlthingy, not copied
+            # files that pages read, other than their own txt files
+            'dependencies': {},     # {path: [size, mtime_ns, sha1] or None}
+        }
+        if old_manifest['fingerprint'] is None:
+            old_link_index = None
+        else:
+            old_link_index = self._get_link_index(old_manifest)
+
+        for txtfile in old_manifest['pages'].keys() - set(self.infiles):
+            self._output.remove(self._outfile(txtfile))
+        if old_manifest['fingerprint'] != new_manifest['fingerprint']:
+            old_manifest['pages'].clear()
+
+        # pages that read changed files must be built again
+        changed, dependency_records = self._find_changed_dependencies(
+            old_manifest['dependencies'])
+        old_entries = {txtfile: entry
+                       for txtfile, entry in old_manifest['pages'].items()
+                       if changed.isdisjoint(entry['depends'])}
+
+        self.converter.link_records = {}
+        try:
+            for txtfile, entry in self._build_pages(old_entries):
+                new_manifest['pages'][txtfile] = entry
+        finally:
+            self.converter.link_records = None
+        new_manifest['dependencies'] = self._get_dependency_records(
+            new_manifest['pages'], dependency_records)
+        self._dependencies = set(new_manifest['dependencies'])
+        if self.search_index:
+            self._write_search_index(new_manifest, old_manifest.get('search'))
+
+        if self.converter.pygments_classes:
+            self._output.write('pygments.css', [htmlthingy.tags.pygments_css(
+                self.converter.pygments_style), '\n'])
+            new_manifest['generated'].append('pygments.css')
+
+        new_manifest['files'] = self._sync_files(self.additional_files,
+                                                 old_manifest['files'])
+        if self.precompress:
+            self._update_compressed(new_manifest)
+
+        for path in (set(old_manifest['generated']) -
+                     set(new_manifest['generated'])):
+            self._output.remove(path)
+
+        self._write_manifest(new_manifest)
+        self._output.close()
+        if self.converter.highlight_cache_dir is not None:
+            htmlthingy.tags.prune_highlight_cache(
+                self.converter.highlight_cache_dir)
+        if self.profile is not None:
+            self.converter.profiler.write_json(self.profile)
+            self.converter.profiler.print_summary()
+            print("Wrote profiling results to '%s'" % self.profile)
+
+        self._link_index = self._get_link_index(new_manifest)
+        if old_link_index is not None:
+            self._warn_about_broken_links(old_link_index, self._link_index)
+
+    def check_links(self):
+        """Print a message for each invalid link in the HTML files.
+
+        Call this after :meth:`run`. The ids and links were recorded
+        while building, so the HTML files are not read. Links and ids
+        in raw HTML written in the markup aren't known here; use
+        :func:`htmlthingy.linkcheck.run` if you need to check those.
+        """
+        from htmlthingy import linkcheck
+
+        assert self._link_index is not None, "call run() first"
+        linkcheck.check(self._link_index, self.outputdir)
 
     # rest of these are meant to be monkey-patched
-    def get_title(self, txtfile):
+    # if they have a content parameter, they get the content of the txtfile
+    # as a string, so they don't need to read it again
+    def get_title(self, txtfile, content=None):
         # this is lol
-        with open(txtfile, 'r', encoding='utf-8') as file:
-            firstline = file.readline()
+        if content is None:
+            with open(txtfile, 'r', encoding='utf-8') as file:
+                firstline = file.readline()
+        else:
+            firstline = content[:content.find('\n') + 1] or content
         return firstline.lstrip(string.whitespace + string.punctuation)
 
-    def get_head_extras(self, txtfile):
+    def get_head_extras(self, txtfile, content=None):
         return ''
 
-    def get_sidebar_content(self, txtfile):
+    def get_sidebar_content(self, txtfile, content=None):
         return None
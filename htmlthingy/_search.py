@@ -0,0 +1,170 @@
+"""The search index written with ``Builder(search_index=True)``.
+
+Pages are split into sections at headings that have an id, and each
+section is a "document" that search results can link to. The index is
+in the ``search`` directory of the output:
+
+* ``search/docs.json`` is a list of ``[url, section_title, page_title]``
+  lists, where the url is e.g. ``'foo.html#subtitle'``. The position in
+  this list is the document's id. Some items may be ``null``.
+* ``search/XX.json`` contains the words whose first 2 characters are
+  ``XX``, see :func:`shard_name`. It's a ``{word: ids}`` dictionary,
+  and the ids are sorted and delta-encoded: the first number is an id,
+  and the others are differences to the previous id.
+
+Words are found with :func:`tokenize`. A browser can look up a word by
+fetching just ``docs.json`` and one shard.
+"""
+
+import html.parser
+import re
+
+SHARD_PREFIX_LENGTH = 2
+_HEADINGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+_WORD_REGEX = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Return a sorted list of the words in text, in lowercase.
+
+    >>> tokenize("Hello, World! HELLO x_y 2")
+    ['hello', 'world', 'x_y']
+    """
+    return sorted({word for word in _WORD_REGEX.findall(text.lower())
+                   if len(word) >= SHARD_PREFIX_LENGTH})
+
+
+def shard_name(word):
+    """Return the name of the shard that contains *word*.
+
+    Names of non-ASCII words are UTF-8 in hex, because they would be
+    problematic as file names.
+
+    >>> shard_name('hello')
+    'he'
+    >>> shard_name('\\N{LATIN SMALL LETTER A WITH DIAERESIS}iti')
+    'c3a469'
+    """
+    prefix = word[:SHARD_PREFIX_LENGTH]
+    if re.fullmatch(r'[a-z0-9_]+', prefix):
+        return prefix
+    return prefix.encode('utf-8').hex()
+
+
+class SectionParser(html.parser.HTMLParser):
+    """Collects the words of each section from HTML given to :meth:`feed`.
+
+    >>> parser = SectionParser('Page')
+    >>> parser.feed('<p>Intro</p><h2 id="more">More<a class="headerlink" '
+    ...             'href="#more">\\N{PILCROW SIGN}</a></h2><p>Text here')
+    >>> parser.get_sections()
+    [['', 'Page', ['intro']], ['more', 'More', ['here', 'more', 'text']]]
+    """
+
+    def __init__(self, page_title):
+        super().__init__(convert_charrefs=True)
+        self.page_title = page_title
+        self._sections = [['', page_title, []]]     # [[id, title, texts]]
+        self._heading = None        # (tag, texts) when inside a heading
+        self._skipped_tag = None    # e.g. 'script' when inside <script>
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if self._skipped_tag is not None:
+            return
+        if tag in {'script', 'style'} or (
+                tag == 'a' and attrs.get('class') == 'headerlink'):
+            self._skipped_tag = tag
+        elif tag in _HEADINGS and attrs.get('id'):
+            self._sections.append([attrs['id'], attrs['id'], []])
+            self._heading = (tag, [])
+
+    def handle_endtag(self, tag):
+        if tag == self._skipped_tag:
+            self._skipped_tag = None
+        elif self._heading is not None and tag == self._heading[0]:
+            title = ' '.join(''.join(self._heading[1]).split())
+            if title:
+                self._sections[-1][1] = title
+            self._heading = None
+
+    def handle_data(self, data):
+        if self._skipped_tag is None:
+            self._sections[-1][2].append(data)
+            if self._heading is not None:
+                self._heading[1].append(data)
+
+    def feed_through(self, pieces):
+        """Feed strings from an iterable to the parser and yield them."""
+        for piece in pieces:
+            self.feed(piece)
+            yield piece
+
+    def get_sections(self):
+        """Return a list of ``[id, title, words]`` lists.
+
+        Sections without words are left out.
+        """
+        self.close()
+        result = []
+        for id_, title, texts in self._sections:
+            words = tokenize(' '.join(texts))
+            if words:
+                result.append([id_, title, words])
+        return result
+
+
+def update_index(pages, old_docs):
+    """Return ``(docs, shards)`` for writing the search index.
+
+    *pages* is a ``{html_path: {'title': title, 'sections': sections}}``
+    dictionary, with sections from :meth:`SectionParser.get_sections`.
+    Documents in *old_docs*, the docs of the previous build, keep their
+    ids, so that changing one page doesn't change every shard.
+
+    >>> pages = {'a.html': {'title': 'A', 'sections': [['', 'A', ['hi']]]},
+    ...          'b.html': {'title': 'B', 'sections': [['x', 'X', ['hi']]]}}
+    >>> docs, shards = update_index(pages, [None, ['b.html#x', 'X', 'B']])
+    >>> docs
+    [['a.html', 'A', 'A'], ['b.html#x', 'X', 'B']]
+    >>> shards
+    {'hi': {'hi': [0, 1]}}
+    """
+    words_by_url = {}       # {url: (doc, words)}
+    for path, page in pages.items():
+        for id_, title, words in page['sections']:
+            url = path + '#' + id_ if id_ else path
+            if url in words_by_url:
+                # e.g. two titles with the same text
+                words = sorted(set(words) | set(words_by_url[url][1]))
+            words_by_url[url] = ([url, title, page['title']], words)
+
+    docs = [doc if doc is not None and doc[0] in words_by_url else None
+            for doc in old_docs]
+    ids = {doc[0]: id_ for id_, doc in enumerate(docs) if doc is not None}
+    free_ids = [id_ for id_, doc in reversed(list(enumerate(docs)))
+                if doc is None]
+
+    postings = {}       # {word: [id, ...]}
+    for url, (doc, words) in words_by_url.items():
+        try:
+            id_ = ids[url]
+        except KeyError:
+            if free_ids:
+                id_ = free_ids.pop()
+            else:
+                id_ = len(docs)
+                docs.append(None)
+        docs[id_] = doc
+        for word in words:
+            postings.setdefault(word, []).append(id_)
+
+    while docs and docs[-1] is None:
+        del docs[-1]
+
+    shards = {}
+    for word in sorted(postings):
+        doc_ids = sorted(postings[word])
+        shards.setdefault(shard_name(word), {})[word] = [doc_ids[0]] + [
+            b - a for a, b in zip(doc_ids, doc_ids[1:])]
+    return (docs, shards)
@@ -0,0 +1,116 @@
+import functools
+import http.server
+import os
+import posixpath
+import traceback
+import urllib.parse
+
+from htmlthingy import outputs
+
+
+def _url_to_path(url):
+    """Return the path of the output file that *url* points to.
+
+    >>> _url_to_path('/')
+    'index.html'
+    >>> _url_to_path('/sub/dir/')
+    'sub/dir/index.html'
+    >>> _url_to_path('/sub/page.html?x=1#y')
+    'sub/page.html'
+    >>> _url_to_path('/../sub/./a%20b.html')
+    'sub/a b.html'
+    """
+    path = urllib.parse.unquote(urllib.parse.urlsplit(url).path)
+    # normpath() removes the trailing slash
+    is_directory = path.endswith('/')
+    path = posixpath.normpath(path).lstrip('/')
+    if path in {'', '.'}:
+        return 'index.html'
+    if is_directory:
+        return path + '/index.html'
+    return path
+
+
+class _RequestHandler(http.server.SimpleHTTPRequestHandler):
+
+    def __init__(self, *args, builder, **kwargs):
+        self.builder = builder
+        super().__init__(*args, directory=builder.outputdir, **kwargs)
+
+    def _find_txtfile(self):
+        path = _url_to_path(self.path)
+        for txtfile in self.builder.infiles:
+            htmlfile = os.path.relpath(self.builder.infile2outfile(txtfile),
+                                       self.builder.outputdir)
+            if htmlfile.replace(os.sep, '/') == path:
+                return txtfile
+        return None
+
+    def _send_page(self, head_only):
+        txtfile = self._find_txtfile()
+        if txtfile is None:
+            return False
+
+        try:
+            with self.builder._lock:
+                content = self.builder.render_page(txtfile)
+            status = 200
+            content_type = 'text/html; charset=utf-8'
+        except Exception:
+            # show the error in the browser, that's handy when editing
+            content = traceback.format_exc()
+            status = 500
+            content_type = 'text/plain; charset=utf-8'
+
+        self._send(status, content_type, content.encode('utf-8'), head_only)
+        return True
+
+    def _send(self, status, content_type, body, head_only):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if not head_only:
+            self.wfile.write(body)
+
+    def _send_file(self, head_only):
+        # files that aren't in a directory can't be served by the base class
+        output = self.builder._get_output()
+        if isinstance(output, outputs.DirectoryOutput):
+            return False
+
+        path = _url_to_path(self.path)
+        try:
+            with self.builder._lock:
+                body = output.read(path)
+        except FileNotFoundError:
+            with self.builder._lock:
+                is_directory = output.exists(path + '/index.html')
+            if is_directory:
+                # like the base class does with directories
+                self.send_response(301)
+                self.send_header('Location',
+                                 '/' + urllib.parse.quote(path) + '/')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self.send_error(404, "File not found")
+            return True
+        self._send(200, self.guess_type(path), body, head_only)
+        return True
+
+    def do_GET(self):
+        if not (self._send_page(head_only=False) or
+                self._send_file(head_only=False)):
+            super().do_GET()
+
+    def do_HEAD(self):
+        if not (self._send_page(head_only=True) or
+                self._send_file(head_only=True)):
+            super().do_HEAD()
+
+
+def create_server(builder, host, port):
+    handler = functools.partial(_RequestHandler, builder=builder)
+    return http.server.ThreadingHTTPServer((host, port), handler)
@@ -0,0 +1,225 @@
+import concurrent.futures
+import filecmp
+import functools
+import hashlib
+import os
+import shutil
+
+import htmlthingy
+
+# see 'man ioctl_ficlone', this makes a copy-on-write copy of a file
+_FICLONE = 0x40049409
+
+# write_file() keeps this much output in memory before it starts writing
+BUFFER_SIZE = 4 * 1024 * 1024
+
+def hash_file(path):
+    hasher = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(functools.partial(file.read, 64*1024), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def file_record(path, old_record=None):
+    """Return a ``[size, mtime_ns, sha1]`` list, or None if there's no file.
+
+    The file is hashed only if its size or modification time is not
+    the same as in *old_record*.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    size_and_mtime = [stat.st_size, stat.st_mtime_ns]
+    if old_record is not None and old_record[:2] == size_and_mtime:
+        return old_record
+    return size_and_mtime + [hash_file(path)]
+
+
+def _create_temp_file(path):
+    # like tempfile.mkstemp(), but the permissions of the file come from
+    # the umask like with open(path, 'w'), instead of being 0o600
+    directory, name = os.path.split(path)
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        temp_path = os.path.join(directory or '.', '.%s.%s.tmp' % (
+            name, os.urandom(4).hex()))
+        try:
+            return (os.open(temp_path, flags, 0o666), temp_path)
+        except FileExistsError:
+            pass
+
+
+def _same_content(path, data):
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        with open(path, 'rb') as file:
+            return file.read() == data
+    except FileNotFoundError:
+        return False
+
+
+def write_file(path, pieces, encoding='utf-8'):
+    """Write strings from the *pieces* iterable to a file atomically.
+
+    The file is written to a temporary file that is renamed to *path*
+    when it's complete, so an interrupted build never leaves half-written
+    files behind. If the file already has the same content, it's left
+    untouched, keeping its modification time. Returns True if the file
+    was written.
+
+    If *encoding* is None, the pieces must be bytes.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    buffer = []
+    size = 0
+    pieces = iter(pieces)
+    for piece in pieces:
+        buffer.append(piece if encoding is None else piece.encode(encoding))
+        size += len(buffer[-1])
+        if size > BUFFER_SIZE:
+            break
+    else:
+        # everything fits in memory, the usual case
+        data = b''.join(buffer)
+        if _same_content(path, data):
+            return False
+        buffer = [data]
+
+    fd, temp_path = _create_temp_file(path)
+    try:
+        with open(fd, 'wb', buffering=BUFFER_SIZE) as file:
+            file.writelines(buffer)
+            for piece in pieces:
+                file.write(piece if encoding is None else
+                           piece.encode(encoding))
+
+        if (size > BUFFER_SIZE and os.path.isfile(path) and
+                filecmp.cmp(temp_path, path, shallow=False)):
+            os.remove(temp_path)
+            return False
+
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return True
+
+
+def _reflink(source, dest):
+    import fcntl        # not available on windows
+
+    with open(source, 'rb') as src, open(dest, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+    shutil.copystat(source, dest)
+
+
+def _copy(source, dest, method):
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+    # if dest is a hard link to source, writing to it would also change
+    # the source file
+    if os.path.lexists(dest):
+        os.remove(dest)
+
+    if method == 'hardlink':
+        try:
+            os.link(source, dest)
+            return
+        except OSError:     # e.g. different file systems
+            pass
+    elif method == 'reflink':
+        try:
+            _reflink(source, dest)
+            return
+        except (ImportError, OSError):      # file system doesn't support it
+            if os.path.lexists(dest):
+                os.remove(dest)
+    else:
+        assert method == 'copy', "unknown copy method %r" % method
+    shutil.copy2(source, dest)
+
+
+def _sync_one(source, dest, old_record, method):
+    # returns a [size, mtime_ns, hash] record
+    stat = os.stat(source)
+    size_and_mtime = [stat.st_size, stat.st_mtime_ns]
+    dest_ok = os.path.isfile(dest) and os.path.getsize(dest) == stat.st_size
+
+    if old_record is not None and dest_ok:
+        if old_record[:2] == size_and_mtime:
+            return old_record
+        # e.g. touched but not modified
+        sha = hash_file(source)
+        if old_record[2] == sha:
+            return size_and_mtime + [sha]
+    else:
+        sha = hash_file(source)
+
+    _copy(source, dest, method)
+    return size_and_mtime + [sha]
+
+
+def _expand(sources):
+    # replace directories with the files in them
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield source
+
+
+def sync(sources, outputdir, old_records, method='copy',
+         message="Copying additional files"):
+    """Copy changed files to *outputdir* and delete files no longer used.
+
+    *old_records* should be the return value of the previous call, or an
+    empty dict. The *method* can be ``'copy'``, ``'hardlink'`` or
+    ``'reflink'``.
+    """
+    files = list(_expand(sources))
+    records = {}
+    if files:
+        # copying is mostly waiting for the disk, so threads are fine
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            results = executor.map(
+                lambda path: _sync_one(path, os.path.join(outputdir, path),
+                                       old_records.get(path), method),
+                files)
+            for path, record in zip(htmlthingy.progressbar(files, message),
+                                    results):
+                records[path] = record
+
+    for path in old_records.keys() - records.keys():
+        dest = os.path.join(outputdir, path)
+        if os.path.lexists(dest):
+            os.remove(dest)
+    return records
+
+
+def sync_output(sources, output, old_records,
+                message="Copying additional files"):
+    """Like :func:`sync`, but writes to a :class:`htmlthingy.outputs.Output`.
+
+    The files are read and written with the output's ``write`` method,
+    so the *method* of :func:`sync` doesn't make sense here.
+    """
+    files = list(_expand(sources))
+    records = {}
+    for path in htmlthingy.progressbar(files, message):
+        old_record = old_records.get(path)
+        records[path] = file_record(path, old_record)
+        if (old_record is None or old_record[2] != records[path][2] or
+                not output.exists(path)):
+            with open(path, 'rb') as file:
+                output.write(path, [file.read()], encoding=None)
+
+    for path in old_records.keys() - records.keys():
+        output.remove(path)
+    return records
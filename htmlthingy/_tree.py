@@ -0,0 +1,141 @@
+"""Document tree created by :meth:`htmlthingy.MarkupConverter.parse`.
+
+The nodes don't know anything about Pygments styles or other output
+settings, so a tree can be cached and rendered again with different
+settings. Rendering is done with
+:meth:`htmlthingy.MarkupConverter.render`.
+"""
+
+import re
+
+from htmlthingy import tags
+
+
+class Node:
+    __slots__ = ()
+
+    def render(self, converter, filename):
+        """Yield pieces of HTML."""
+        raise NotImplementedError
+
+    def __eq__(self, other):
+        return (type(self) is type(other) and
+                all(getattr(self, name) == getattr(other, name)
+                    for name in self.__slots__))
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            repr(getattr(self, name)) for name in self.__slots__))
+
+
+class Raw(Node):
+    """HTML that is output as is, e.g. text or output of custom handlers."""
+    __slots__ = ('html',)
+
+    def __init__(self, html):
+        self.html = html
+
+    def render(self, converter, filename):
+        yield self.html
+
+
+class Fragment(Node):
+    """A list of nodes without anything around them."""
+    __slots__ = ('children',)
+
+    def __init__(self, children):
+        self.children = children
+
+    def render(self, converter, filename):
+        for child in self.children:
+            yield from child.render(converter, filename)
+
+
+class Element(Node):
+    """An HTML element like ``<b>...</b>``.
+
+    >>> from htmlthingy import MarkupConverter
+    >>> node = Element('a', {'href': 'x.html'}, [Raw('hi')])
+    >>> ''.join(node.render(MarkupConverter(), 'test.txt'))
+    '<a href="x.html">hi</a>'
+    """
+    __slots__ = ('tag', 'attrs', 'children')
+
+    def __init__(self, tag, attrs, children):
+        self.tag = tag
+        self.attrs = attrs
+        self.children = children
+
+    def set_id(self, id_):
+        # the id goes first, like id_adder used to put it
+        attrs = {'id': id_}
+        attrs.update((key, value) for key, value in self.attrs.items()
+                     if key != 'id')
+        self.attrs = attrs
+
+    def render(self, converter, filename):
+        if 'id' in self.attrs:
+            converter.record_id(filename, self.attrs['id'])
+        if self.tag == 'a' and 'href' in self.attrs:
+            converter.record_link(filename, self.attrs['href'])
+
+        yield '<%s%s>' % (self.tag, ''.join(
+            ' %s="%s"' % item for item in self.attrs.items()))
+        for child in self.children:
+            yield from child.render(converter, filename)
+        yield '</%s>' % self.tag
+
+
+class Title(Node):
+    """See :func:`htmlthingy.tags.title`."""
+    __slots__ = ('level', 'children', 'id')
+
+    def __init__(self, level, children, id_=None):
+        self.level = level
+        self.children = children
+        self.id = id_
+
+    def set_id(self, id_):
+        self.id = id_
+
+    def render(self, converter, filename):
+        content = ''.join(Fragment(self.children).render(converter, filename))
+        id_ = tags._id_ify(content) if self.id is None else self.id
+        converter.record_id(filename, id_)
+        yield tags.title(content, self.level, id_)
+
+
+class Code(Node):
+    """See :func:`htmlthingy.tags.multiline_code`."""
+    __slots__ = ('code', 'lexer_name')
+
+    def __init__(self, code, lexer_name):
+        self.code = code
+        self.lexer_name = lexer_name
+
+    def render(self, converter, filename):
+        yield tags.multiline_code(self.code, self.lexer_name,
+                                  converter.pygments_style,
+                                  noclasses=not converter.pygments_classes,
+                                  cache_dir=converter.highlight_cache_dir)
+
+
+class AddId(Node):
+    """Adds an id to the first tag of the children's HTML.
+
+    This is used with ``(id)`` when the first child isn't an
+    :class:`Element` or a :class:`Title`.
+    """
+    __slots__ = ('id', 'children')
+
+    def __init__(self, id_, children):
+        self.id = id_
+        self.children = children
+
+    def render(self, converter, filename):
+        content = ''.join(
+            Fragment(self.children).render(converter, filename)).lstrip()
+        regex = re.compile(r'^<(\w+)')
+        assert regex.search(content) is not None, "cannot use (...) here"
+        converter.record_id(filename, self.id)
+        yield regex.sub(r'<\1 id="%s"' % self.id, content, count=1)
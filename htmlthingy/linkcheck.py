@@ -1,47 +1,133 @@
-"""Check links in HTML files."""
+"""Check links in HTML files.
 
-import glob
+:class:`htmlthingy.Builder` remembers the ids and links of the pages it
+creates, and :meth:`htmlthingy.Builder.check_links` checks them without
+reading any files. Use :func:`run` to check a directory of HTML files
+that may contain links and ids that the converter doesn't know about,
+e.g. links written as raw HTML in the markup. It also works with the
+outputs in :mod:`htmlthingy.outputs`, so e.g. a
+:class:`~htmlthingy.outputs.MemoryOutput` doesn't need to be written to
+disk for checking it.
+"""
+
+import html.parser
+import multiprocessing
 import os
 import pathlib
-import re
 
-import bs4
+from htmlthingy import outputs, progressbar
 
-from htmlthingy import progressbar
 
+class _LinkParser(html.parser.HTMLParser):
 
-def run(htmldir):
-    htmlfiles = list(map(str, pathlib.Path(htmldir).rglob('*.html')))
-    valid_targets = set()
-    links = {}      # {filename: linklist}
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.ids = []
+        self.links = []
 
-    for filename in progressbar(htmlfiles, "Checking links"):
-        valid_targets.add(os.path.relpath(filename, htmldir))
+    def handle_starttag(self, tag, attrs):
+        # <p id> is same as <p id="">
+        attrs = dict(attrs)
+        if 'id' in attrs:
+            self.ids.append(attrs['id'] or '')
+        if tag == 'a' and 'href' in attrs:
+            self.links.append(attrs['href'] or '')
 
-        with open(filename, 'r', encoding='utf-8') as file:
-            soup = bs4.BeautifulSoup(file.read(), 'html.parser')
 
-        for element in soup.find_all():
-            try:
-                valid_targets.add(os.path.basename(filename) +
-                                  '#' + element['id'])
-            except KeyError:
-                pass
+def find_ids_and_links(html_string):
+    """Return a two-tuple of ``id`` attributes and ``<a>`` link targets.
 
-        for link in soup.find_all('a'):
-            try:
-                href = link['href']
-            except KeyError:
-                continue
-            if href.startswith(('http://', 'https://')):
-                continue
+    >>> find_ids_and_links('<h1 id="a">x</h1><a href="b.html">y</a><a>z</a>')
+    (['a'], ['b.html'])
+    """
+    parser = _LinkParser()
+    parser.feed(html_string)
+    parser.close()
+    return (parser.ids, parser.links)
+
+
+def _scan_file(filename):
+    # reads the file in pieces, so huge files don't need much memory
+    parser = _LinkParser()
+    with open(filename, 'r', encoding='utf-8') as file:
+        for piece in iter(lambda: file.read(64*1024), ''):
+            parser.feed(piece)
+    parser.close()
+    return (parser.ids, parser.links)
 
-            if href.startswith('#'):
-                href = os.path.basename(filename) + href
-            links.setdefault(filename, []).append(href)
 
-    for filename, targets in links.items():
-        for target in targets:
+def _scan_bytes(data):
+    return find_ids_and_links(data.decode('utf-8'))
+
+
+def find_invalid_links(pages):
+    """Return a list of ``(path, target)`` pairs for invalid links.
+
+    *pages* should be a ``{path: (ids, links)}`` dictionary.
+
+    >>> find_invalid_links({'a.html': (['x'], ['b.html', '#x']),
+    ...                     'b.html': ([], ['a.html#y'])})
+    [('b.html', 'a.html#y')]
+    """
+    valid_targets = set()
+    for path, (ids, links) in pages.items():
+        valid_targets.add(path)
+        valid_targets.update(os.path.basename(path) + '#' + id_
+                             for id_ in ids)
+
+    result = []
+    for path, (ids, links) in pages.items():
+        for target in links:
+            if target.startswith(('http://', 'https://')):
+                continue
+            if target.startswith('#'):
+                target = os.path.basename(path) + target
             if target not in valid_targets:
-                print("linkcheck: %s contains an invalid link to %s"
-                      % (filename, target))
+                result.append((path, target))
+    return result
+
+
+def print_invalid_link(path, target, htmldir):
+    print("linkcheck: %s contains an invalid link to %s"
+          % (pathlib.Path(htmldir, path), target))
+
+
+def check(pages, htmldir):
+    """Print a message for each invalid link in *pages*.
+
+    *pages* should be a ``{path: (ids, links)}`` dictionary where the
+    paths are relative to *htmldir*.
+    """
+    for path, target in find_invalid_links(pages):
+        print_invalid_link(path, target, htmldir)
+
+
+def run(htmldir, jobs=1):
+    """Check links in all HTML files in *htmldir*.
+
+    *htmldir* can also be a :class:`htmlthingy.outputs.Output` that a
+    :class:`htmlthingy.Builder` has written to. With ``jobs > 1``, the
+    files are parsed in that many processes at the same time.
+    """
+    if isinstance(htmldir, outputs.Output):
+        paths = [path for path in htmldir.paths() if path.endswith('.html')]
+        # reading is fast, the parsing is done in parallel
+        scan, args = (_scan_bytes, map(htmldir.read, paths))
+        htmldir = ''
+    else:
+        htmlfiles = list(map(str, pathlib.Path(htmldir).rglob('*.html')))
+        paths = [os.path.relpath(filename, htmldir) for filename in htmlfiles]
+        scan, args = (_scan_file, htmlfiles)
+    pages = {}      # {relative_path: (ids, links)}
+
+    if jobs == 1:
+        for path, arg in zip(progressbar(paths, "Checking links"), args):
+            pages[path] = scan(arg)
+    else:
+        with multiprocessing.Pool(jobs) as pool:
+            results = pool.imap(scan, args, chunksize=16)
+            for path, result in zip(progressbar(paths, "Checking links"),
+                                    results):
+                pages[path] = result
+
+    check(pages, htmldir)
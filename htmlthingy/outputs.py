@@ -0,0 +1,285 @@
+"""Places where :class:`htmlthingy.Builder` can write the HTML files.
+
+By default, the files go to a directory. Use e.g.
+``htmlthingy.Builder(output=htmlthingy.outputs.ZipOutput('site.zip'))``
+to write them straight into an archive, or :class:`MemoryOutput` to
+keep them in a dictionary.
+
+Paths given to outputs are relative, like ``'index.html'`` or
+``'images/cat.png'``.
+"""
+
+import io
+import os
+import shutil
+
+from htmlthingy import _sync
+
+
+def _to_bytes(pieces, encoding):
+    if encoding is None:
+        return b''.join(pieces)
+    return ''.join(pieces).encode(encoding)
+
+
+class Output:
+    """Base class for outputs.
+
+    Subclasses must override :meth:`read`, :meth:`write`,
+    :meth:`remove` and :meth:`paths`.
+    """
+
+    #: True if files written in one build are still there in the next
+    #: build, so that incremental builds can reuse them.
+    persistent = True
+
+    def read(self, path):
+        """Return the content of a file as bytes.
+
+        Raises :exc:`FileNotFoundError` if the file doesn't exist.
+        """
+        raise NotImplementedError
+
+    def write(self, path, pieces, encoding='utf-8'):
+        """Write strings from the *pieces* iterable to a file.
+
+        If *encoding* is None, the pieces must be bytes.
+        """
+        raise NotImplementedError
+
+    def remove(self, path):
+        """Remove a file, or all files in a directory.
+
+        Nothing happens if there's no such file.
+        """
+        raise NotImplementedError
+
+    def paths(self):
+        """Return a sorted list of the paths of all files."""
+        raise NotImplementedError
+
+    def exists(self, path):
+        return path in self.paths()
+
+    def clear(self):
+        """Remove everything."""
+        for path in self.paths():
+            self.remove(path)
+
+    def close(self):
+        """Called at the end of a build."""
+
+
+class DirectoryOutput(Output):
+    """Writes files to the directory at *path*.
+
+    This is what :class:`htmlthingy.Builder` uses by default, with its
+    ``outputdir`` attribute as the path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _full_path(self, path):
+        return os.path.join(self.path, path)
+
+    def read(self, path):
+        with open(self._full_path(path), 'rb') as file:
+            return file.read()
+
+    def write(self, path, pieces, encoding='utf-8'):
+        # atomic, and leaves files with the same content untouched
+        return _sync.write_file(self._full_path(path), pieces, encoding)
+
+    def remove(self, path):
+        full_path = self._full_path(path)
+        if os.path.isdir(full_path):
+            shutil.rmtree(full_path)
+        elif os.path.lexists(full_path):
+            os.remove(full_path)
+
+    def paths(self):
+        result = []
+        for root, dirs, files in os.walk(self.path):
+            result.extend(os.path.relpath(os.path.join(root, name), self.path)
+                          for name in files)
+        return sorted(result)
+
+    def exists(self, path):
+        return os.path.exists(self._full_path(path))
+
+    def clear(self):
+        if os.path.exists(self.path):
+            print("Removing '%s' directory..." % self.path)
+            shutil.rmtree(self.path)
+
+
+class MemoryOutput(Output):
+    """Keeps the files in the :attr:`files` dictionary.
+
+    >>> output = MemoryOutput()
+    >>> output.write('hello.html', ['<p>Hello', '</p>'])
+    >>> output.files
+    {'hello.html': b'<p>Hello</p>'}
+
+    Reusing the same :class:`MemoryOutput` in many builds works like
+    building to the same directory, so incremental builds are possible.
+    """
+
+    def __init__(self):
+        self.files = {}     # {path: bytes}
+
+    def read(self, path):
+        try:
+            return self.files[path.replace(os.sep, '/')]
+        except KeyError:
+            raise FileNotFoundError(path) from None
+
+    def write(self, path, pieces, encoding='utf-8'):
+        self.files[path.replace(os.sep, '/')] = _to_bytes(pieces, encoding)
+
+    def remove(self, path):
+        path = path.replace(os.sep, '/')
+        self.files.pop(path, None)
+        for name in [name for name in self.files
+                     if name.startswith(path + '/')]:
+            del self.files[name]
+
+    def paths(self):
+        return sorted(self.files)
+
+    def exists(self, path):
+        return path.replace(os.sep, '/') in self.files
+
+    def clear(self):
+        self.files.clear()
+
+
+class _ArchiveOutput(Output):
+    # each build creates a new archive, so files from the previous build
+    # can't be reused
+    persistent = False
+
+    def __init__(self, file):
+        self.file = file      # a path or a binary file object
+        self._archive = None
+        self._names = []
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _add(self, name, data):
+        raise NotImplementedError
+
+    def _read_closed(self, name):
+        raise NotImplementedError
+
+    def read(self, path):
+        if self._archive is not None:
+            raise io.UnsupportedOperation(
+                "cannot read from an archive before it's closed")
+        if not isinstance(self.file, (str, os.PathLike)):
+            if not self.file.seekable():
+                raise io.UnsupportedOperation("the archive is not seekable")
+            self.file.seek(0)
+        try:
+            return self._read_closed(path.replace(os.sep, '/'))
+        except KeyError:
+            raise FileNotFoundError(path) from None
+
+    def write(self, path, pieces, encoding='utf-8'):
+        if self._archive is None:
+            self._archive = self._open()
+            self._names.clear()
+        name = path.replace(os.sep, '/')
+        assert name not in self._names, "%s was written twice" % name
+        self._add(name, _to_bytes(pieces, encoding))
+        self._names.append(name)
+
+    def remove(self, path):
+        # builds start from scratch, so files are removed only when
+        # nothing has been written yet
+        assert path.replace(os.sep, '/') not in self._names, (
+            "cannot remove files from an archive")
+
+    def paths(self):
+        return sorted(self._names)
+
+    def clear(self):
+        self.close()
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+
+class ZipOutput(_ArchiveOutput):
+    """Writes the files to a new zip file.
+
+    *file* can be a path or a binary file object. The files are
+    compressed, and their modification times are set to 1980, so
+    building the same site twice creates identical zip files.
+    """
+
+    def _open(self):
+        import zipfile
+
+        return zipfile.ZipFile(self.file, 'w', zipfile.ZIP_DEFLATED)
+
+    def _add(self, name, data):
+        import zipfile
+
+        info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        self._archive.writestr(info, data)
+
+    def _read_closed(self, name):
+        import zipfile
+
+        with zipfile.ZipFile(self.file) as archive:
+            return archive.read(name)
+
+
+class TarOutput(_ArchiveOutput):
+    """Writes the files to a new tar file.
+
+    *file* can be a path or a binary file object. The archive is
+    written as a stream, so *file* doesn't need to be seekable, and it
+    can be e.g. a pipe. *compression* can be ``''``, ``'gz'``, ``'bz2'``
+    or ``'xz'``.
+    """
+
+    def __init__(self, file, compression=''):
+        super().__init__(file)
+        self.compression = compression
+
+    def _open(self):
+        import tarfile
+
+        mode = 'w|' + self.compression
+        if isinstance(self.file, (str, os.PathLike)):
+            return tarfile.open(self.file, mode)
+        return tarfile.open(fileobj=self.file, mode=mode)
+
+    def _add(self, name, data):
+        import tarfile
+
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mode = 0o644
+        self._archive.addfile(info, io.BytesIO(data))
+
+    def _read_closed(self, name):
+        import tarfile
+
+        if isinstance(self.file, (str, os.PathLike)):
+            archive = tarfile.open(self.file)
+        else:
+            archive = tarfile.open(fileobj=self.file)
+        with archive:
+            member = archive.extractfile(name)
+            if member is None:      # e.g. a directory
+                raise KeyError(name)
+            return member.read()
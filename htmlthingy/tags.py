@@ -1,9 +1,13 @@
 """Functions that output bits of HTML like ``'<h1>Hello World</h1>'``."""
 
+import functools
+import hashlib
+import os
 import re
+import time
 
-import pygments.formatters
-import pygments.lexers
+# pygments is imported when the first code block is highlighted, because
+# importing it is slow and many scripts never highlight anything
 
 
 def _id_ify(string):
@@ -19,11 +23,13 @@ def _id_ify(string):
     return ''.join(map('{:02x}'.format, string.encode('utf-8')))[:10]
 
 
-def title(content, level=1):
+def title(content, level=1, id_=None):
     """Corresponds to ``### content`` in the markup.
 
     :param content: HTML that will go inside the tags.
     :param level: number of ``#``'s in the markup.
+    :param id_: the ``id`` attribute, by default it's created from the
+                content.
 
     >>> title('Hello World!')
     '<h1 id="hello-world">Hello World!</h1>'
@@ -35,7 +41,9 @@ def title(content, level=1):
     return ('<h{level} id="{id}">{}'
             '<a class="headerlink" href="#{id}" '
             'title="Link to this title">\N{PILCROW SIGN}</a>'
-            '</h{level}>').format(content, id=_id_ify(content), level=level)
+            '</h{level}>').format(
+                content, level=level,
+                id=(_id_ify(content) if id_ is None else id_))
 
 
 def link(content, target):
@@ -105,7 +113,8 @@ def inline_code(code):
     return '<code>' + code + '</code>'
 
 
-def multiline_code(code, lexer_name, pygments_style):
+def multiline_code(code, lexer_name, pygments_style, noclasses=True,
+                   cache_dir=None):
     """Create HTML that displays highlighted code with Pygments.
 
     The HTML is wrapped in a ``<div>`` with ``class="highlight"``.
@@ -115,17 +124,129 @@ def multiline_code(code, lexer_name, pygments_style):
  of lexers <http://pygments.org/docs/lexers/>`_.
     :param pygments_style: name of a Pygments style, see `this style ex\
 ample page <https://help.farbox.com/pygments.html>`_.
+    :param noclasses: if this is False, the HTML uses CSS classes instead
+                      of inline styles, and it needs the CSS from
+                      :func:`pygments_css`.
+    :param cache_dir: if this is a directory path, the HTML is saved
+                      there and reused later. The file names are hashes
+                      of the other arguments and the Pygments version.
+                      See :func:`prune_highlight_cache`.
 
     There's no example because the HTML created by Pygments looks kind
     of messy when viewed as plain text.
+
+    The same code is highlighted only once in each process.
     """
-    if lexer_name == 'python3' and code.startswith('>>> '):
-        lexer = pygments.lexers.PythonConsoleLexer(python3=True)
-    elif lexer_name == 'python' and code.startswith('>>> '):
-        lexer = pygments.lexers.PythonConsoleLexer(python3=False)
+    if cache_dir is None:
+        return _highlight(code, lexer_name, pygments_style, noclasses)
+
+    import tempfile
+
+    path = os.path.join(cache_dir, _highlight_key(
+        code, lexer_name, pygments_style, noclasses) + '.html')
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            result = file.read()
+    except FileNotFoundError:
+        pass
     else:
-        lexer = pygments.lexers.get_lexer_by_name(lexer_name)
+        # prune_highlight_cache() deletes files that haven't been used
+        os.utime(path)
+        return result
+
+    result = _highlight(code, lexer_name, pygments_style, noclasses)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # other processes may be writing the same file at the same time
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with open(fd, 'w', encoding='utf-8') as file:
+            file.write(result)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return result
+
+
+def _highlight_key(code, lexer_name, pygments_style, noclasses):
+    """Return the name of a cache file without the ``.html`` extension.
+
+    It's the SHA-1 of everything that affects the HTML, including the
+    Pygments version, so upgrading Pygments or changing the style never
+    uses old files.
+
+    >>> key = _highlight_key('x = 1', 'python', 'default', True)
+    >>> len(key)
+    40
+    >>> key == _highlight_key('x = 1', 'python', 'monokai', True)
+    False
+    """
+    import pygments
+
+    return hashlib.sha1(repr((
+        code, lexer_name, pygments_style, noclasses, pygments.__version__,
+    )).encode('utf-8')).hexdigest()
+
+
+def prune_highlight_cache(cache_dir, max_age=30*24*60*60):
+    """Delete files that :func:`multiline_code` hasn't used in *max_age*
+    seconds from *cache_dir*.
+
+    Files are never deleted otherwise, so the directory would grow
+    forever as code and styles change.
+    """
+    limit = time.time() - max_age
+    try:
+        entries = list(os.scandir(cache_dir))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if (entry.name.endswith(('.html', '.tmp')) and
+                entry.stat().st_mtime < limit):
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:   # another process removed it
+                pass
+
+
+@functools.lru_cache()
+def _get_lexer(lexer_name, console):
+    import pygments.lexers
+
+    if console and lexer_name == 'python3':
+        return pygments.lexers.PythonConsoleLexer(python3=True)
+    if console and lexer_name == 'python':
+        return pygments.lexers.PythonConsoleLexer(python3=False)
+    return pygments.lexers.get_lexer_by_name(lexer_name)
+
+
+@functools.lru_cache()
+def _get_formatter(pygments_style, noclasses):
+    import pygments.formatters
+
+    return pygments.formatters.HtmlFormatter(
+        style=pygments_style, noclasses=noclasses)
+
+
+def pygments_css(pygments_style):
+    """Return CSS for code highlighted with ``noclasses=False``.
+
+    See :func:`multiline_code`.
+    """
+    return _get_formatter(pygments_style, False).get_style_defs('.highlight')
+
+
+# many pages contain the same code, it's highlighted only once
+@functools.lru_cache(maxsize=1024)
+def _highlight(code, lexer_name, pygments_style, noclasses):
+    """
+    >>> _highlight('x = 1', 'python', 'default', True) is _highlight(
+    ...     'x = 1', 'python', 'default', True)
+    True
+    """
+    import pygments
 
-    formatter = pygments.formatters.HtmlFormatter(
-        style=pygments_style, noclasses=True)
+    lexer = _get_lexer(lexer_name, code.startswith('>>> '))
+    formatter = _get_formatter(pygments_style, noclasses)
     return pygments.highlight(code, lexer, formatter)